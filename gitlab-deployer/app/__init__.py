@@ -1,10 +1,55 @@
 """GitLab Deployer Flask Application"""
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional - Flask's stdlib json provider is used without it
+    orjson = None
+
+
+class OrjsonJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson.
+
+    Output matches the default provider's compact form (sorted keys,
+    non-string keys stringified, dates via the provider's default());
+    indented debug output and any extra json.dumps() arguments still go
+    through the stdlib.
+    """
+
+    def _dumpb(self, obj, option=0):
+        return orjson.dumps(
+            obj, default=self.default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | option
+        )
+
+    def dumps(self, obj, **kwargs):
+        if kwargs and kwargs != {'separators': (',', ':')}:
+            return super().dumps(obj, **kwargs)
+        return self._dumpb(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            self._dumpb(obj, orjson.OPT_APPEND_NEWLINE), mimetype=self.mimetype
+        )
+
 
 def create_app():
     """Create and configure the Flask application"""
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'dev-secret-key-change-in-production'
+    # No endpoint takes large uploads (ISOs are fetched by Proxmox directly)
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    if orjson is not None:
+        app.json = OrjsonJSONProvider(app)
 
     from . import routes
     app.register_blueprint(routes.bp)
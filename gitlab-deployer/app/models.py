@@ -3,7 +3,6 @@ import sqlite3
 import json
 import os
 from pathlib import Path
-from datetime import datetime
 from contextlib import contextmanager
 
 # Database path - use data directory for persistence
@@ -14,9 +13,16 @@ DATABASE_PATH = DATA_DIR / 'buildforever.db'
 
 @contextmanager
 def get_db():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(str(DATABASE_PATH))
+    """Context manager for database connections.
+
+    The database runs in WAL mode (see init_db()), so readers in other
+    request threads aren't blocked by a write; a writer waits up to 10s for
+    another writer instead of failing with 'database is locked'.
+    """
+    conn = sqlite3.connect(str(DATABASE_PATH), timeout=10)
     conn.row_factory = sqlite3.Row
+    # Safe with WAL: a crash can lose the last commit but not corrupt the DB
+    conn.execute('PRAGMA synchronous=NORMAL')
     try:
         yield conn
         conn.commit()
@@ -30,6 +36,8 @@ def get_db():
 def init_db():
     """Initialize the database with required tables"""
     with get_db() as conn:
+        # Persistent - set once, applies to every later connection
+        conn.execute('PRAGMA journal_mode=WAL')
         cursor = conn.cursor()
 
         # Saved configurations table
@@ -633,18 +641,25 @@ class Credential:
     @staticmethod
     def generate_ssh_keypair(name, username, password=None, key_type='ed25519', passphrase=None):
         """Generate a new SSH keypair and save as a credential"""
+        import shutil
         import subprocess
         import tempfile
         import os
 
+        ssh_keygen = shutil.which('ssh-keygen')
+        if not ssh_keygen:
+            raise Exception('ssh-keygen not found. Please install OpenSSH.')
+
         with tempfile.TemporaryDirectory() as tmpdir:
             key_path = os.path.join(tmpdir, 'id_key')
 
             # Generate key using ssh-keygen
-            cmd = ['ssh-keygen', '-t', key_type, '-f', key_path, '-N', passphrase or '', '-C', f'{username}@buildforever']
+            cmd = [ssh_keygen, '-t', key_type, '-f', key_path, '-N', passphrase or '', '-C', f'{username}@buildforever']
 
             try:
-                subprocess.run(cmd, check=True, capture_output=True)
+                # Absolute path + close_fds=False lets subprocess use posix_spawn()
+                # instead of fork(); Python's own fds are non-inheritable anyway
+                subprocess.run(cmd, check=True, capture_output=True, close_fds=False)
 
                 # Read generated keys
                 with open(key_path, 'r') as f:
@@ -1,17 +1,31 @@
 """Proxmox client for VM and container management with full provisioning support."""
-import time
 import os
-import json
-import tempfile
-import subprocess
-import hashlib
+import time
+import random
+import re
+import select
+import shlex
+import socket
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial, wraps
+from types import MappingProxyType
+import uuid
 import base64
-from io import StringIO
 
 # Lazy imports for optional dependencies - these are imported when needed
 # to avoid breaking the module if they're not installed
 _paramiko = None
 _requests = None
+_http_session = None
+_http_session_lock = threading.Lock()
+
+try:
+    import orjson
+except ImportError:  # optional - stdlib json is used without it
+    orjson = None
 
 
 def _get_paramiko():
@@ -44,72 +58,636 @@ def _get_requests():
     return _requests
 
 
+def get_http_session():
+    """Shared requests.Session for outbound HTTP (Microsoft, Apple, GitHub).
+
+    Keeps TCP/TLS connections alive between the sequential calls each image
+    lookup makes, and retries transient connection errors and 5xx responses.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            requests = _get_requests()
+            from urllib3.util.retry import Retry
+
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                          allowed_methods=('GET',), raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def response_json(response):
+    """Decode a requests response body as JSON, with orjson when it's installed."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def download_resumable(url, path, attempts=5, chunk_size=4 * 1024 * 1024, on_progress=None):
+    """Download url to path, resuming a partial file with HTTP Range requests.
+
+    Whatever is already at path is kept, and each attempt asks only for the
+    missing bytes, so a dropped connection near the end of a multi-GB ISO
+    doesn't restart it from zero. Falls back to a full download if the
+    server ignores Range, and starts over if a file the server says is
+    complete (416) doesn't match the remote size. on_progress(bytes_done,
+    total_or_None) is called per chunk. Only connection errors and 5xx
+    responses are retried. Returns True once the file is complete.
+    """
+    requests = _get_requests()
+    http = get_http_session()
+    for attempt in range(attempts):
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                if response.status_code == 416:
+                    # Only complete if the local file is exactly the remote size
+                    if _remote_size(http, url, response) == offset:
+                        return True
+                    print(f"[DOWNLOAD] {path} doesn't match {url}, starting over")
+                    open(path, 'wb').close()
+                    continue
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0  # Range not honoured - start over
+                length = response.headers.get('Content-Length')
+                total = offset + int(length) if length else None
+                done = offset
+                with open(path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        done += len(chunk)
+                        if on_progress:
+                            on_progress(done, total)
+                if total is None or done >= total:
+                    return True
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code < 500:
+                print(f"[DOWNLOAD] {url} failed: {e}")
+                return False
+            print(f"[DOWNLOAD] {url} interrupted at attempt {attempt + 1}/{attempts}: {e}")
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            print(f"[DOWNLOAD] {url} interrupted at attempt {attempt + 1}/{attempts}: {e}")
+        except Exception as e:
+            print(f"[DOWNLOAD] {url} failed: {e}")
+            return False
+        time.sleep(backoff_delay(attempt))
+    return False
+
+
+def _remote_size(http, url, range_response):
+    """Full size of url from a 416's Content-Range (bytes */N), else a HEAD request; None if unknown."""
+    content_range = range_response.headers.get('Content-Range', '')
+    if content_range.startswith('bytes */') and content_range[8:].isdigit():
+        return int(content_range[8:])
+    head = http.head(url, allow_redirects=True, timeout=(10, 60))
+    length = head.headers.get('Content-Length') if head.ok else None
+    return int(length) if length and length.isdigit() else None
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0, jitter=1.0):
+    """Exponential backoff delay (base * 2^attempt, capped) plus random jitter."""
+    return min(cap, base * (2 ** attempt)) + random.uniform(0, jitter)
+
+
+def ttl_cached(ttl, allow_stale=False):
+    """Cache a ProxmoxClient read method per instance for ttl seconds.
+
+    Entries are keyed on the method name and call arguments. With
+    allow_stale, the last cached value is returned if the API call fails.
+    Use ProxmoxClient.invalidate_cache() after changes that affect the result.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            with self._cache_lock:
+                entry = self._cache.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+            try:
+                value = method(self, *args, **kwargs)
+            except Exception:
+                if allow_stale and entry:
+                    return entry[1]
+                raise
+            with self._cache_lock:
+                self._cache[key] = (time.monotonic() + ttl, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def parse_static_ip(net0):
+    """Return the static IP from an LXC net0 config string, or None for DHCP/unset."""
+    for part in net0.split(','):
+        if part.startswith('ip='):
+            value = part[3:]
+            if value and value not in ('dhcp', 'manual'):
+                return value.split('/')[0]
+            return None
+    return None
+
+
+# Ciphers never offered on pooled connections: paramiko's defaults already prefer
+# AES-CTR/GCM (OpenSSL, AES-NI), this just keeps the handshake from settling on
+# CBC or 3DES with an old sshd
+SSH_DISABLED_ALGORITHMS = {
+    'ciphers': ['3des-cbc', 'aes128-cbc', 'aes192-cbc', 'aes256-cbc'],
+}
+
+
+class SSHConnectionPool:
+    """Shared SSH connections keyed by (host, username).
+
+    Each exec_command() opens a new channel on the pooled transport, so
+    successive commands against the same host reuse one TCP/SSH session
+    instead of paying the handshake and authentication every time.
+    Connections are checked out with session() (or acquire()/release()) and
+    counted while in use; only connections nobody holds and that have been
+    idle for longer than idle_timeout are closed. Live connections send an
+    SSH keepalive every keepalive seconds, so a quiet multi-minute install
+    (e.g. GitLab's reconfigure) isn't dropped by NAT/firewall idle timeouts.
+    """
+
+    def __init__(self, idle_timeout=300, keepalive=30):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._host_key_policy = None
+        self._clients = {}  # (host, username) -> [client, last_used, users]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, host, username, password, timeout=30, **connect_kwargs):
+        """Check out a connected paramiko.SSHClient for the duration of a with block."""
+        client = self.acquire(host, username, password, timeout=timeout, **connect_kwargs)
+        try:
+            yield client
+        finally:
+            self.release(host, username, client)
+
+    def acquire(self, host, username, password, timeout=30, **connect_kwargs):
+        """Return a connected paramiko.SSHClient, reusing a live pooled one if present.
+
+        Every acquire() must be paired with a release() of the same client.
+        """
+        key = (host, username)
+        with self._lock:
+            self._evict_idle()
+            entry = self._clients.get(key)
+            if entry:
+                if _transport_active(entry[0]):
+                    entry[2] += 1
+                    return entry[0]
+                # Dead transport - anyone still holding it fails on their own
+                del self._clients[key]
+                if not entry[2]:
+                    entry[0].close()
+
+        paramiko = _get_paramiko()
+        if self._host_key_policy is None:
+            self._host_key_policy = paramiko.AutoAddPolicy()
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(self._host_key_policy)
+        connect_kwargs.setdefault('disabled_algorithms', SSH_DISABLED_ALGORITHMS)
+        try:
+            client.connect(host, username=username, password=password, timeout=timeout, **connect_kwargs)
+        except Exception:
+            client.close()
+            raise
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing and _transport_active(existing[0]):
+                # Another thread connected first - use its connection, drop ours
+                existing[2] += 1
+                winner = existing[0]
+            else:
+                self._clients[key] = [client, time.time(), 1]
+                winner = client
+        if winner is not client:
+            client.close()
+        return winner
+
+    def release(self, host, username, client):
+        """Return a client checked out with acquire().
+
+        A client whose transport has died is dropped from the pool (and
+        closed once no one else holds it); a live one stays pooled.
+        """
+        key = (host, username)
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None or entry[0] is not client:
+                # Already replaced or evicted as dead - close if we were the last user
+                if not _transport_active(client):
+                    client.close()
+                return
+            entry[2] -= 1
+            entry[1] = time.time()
+            if _transport_active(client):
+                return
+            del self._clients[key]
+            if entry[2]:
+                return
+        client.close()
+
+    def close_all(self):
+        """Close every pooled connection."""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for client, _, _ in entries:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _evict_idle(self):
+        now = time.time()
+        for key, (client, last_used, users) in list(self._clients.items()):
+            if not users and now - last_used > self.idle_timeout:
+                del self._clients[key]
+                client.close()
+
+
+def _transport_active(client):
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+ssh_pool = SSHConnectionPool()
+
+_deployer_key = None
+_deployer_key_lock = threading.Lock()
+
+
+def get_deployer_key():
+    """Return (paramiko key, OpenSSH public key line) for BuildForever's own keypair.
+
+    The Ed25519 key is generated under data/ on first use. Containers created
+    through ProxmoxClient get the public half, so provisioning can log in by key
+    instead of password. Returns None if the key can't be loaded or generated.
+    """
+    global _deployer_key
+    with _deployer_key_lock:
+        if _deployer_key is not None:
+            return _deployer_key
+
+        try:
+            from .models import DATA_DIR
+            from cryptography.hazmat.primitives import serialization
+            from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+            paramiko = _get_paramiko()
+
+            key_path = DATA_DIR / 'deployer_ed25519'
+            if not key_path.exists():
+                private_key = Ed25519PrivateKey.generate()
+                pem = private_key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.OpenSSH,
+                    serialization.NoEncryption()
+                )
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(pem)
+
+            pkey = paramiko.Ed25519Key.from_private_key_file(str(key_path))
+            public_key = f'{pkey.get_name()} {pkey.get_base64()} buildforever-deployer'
+            _deployer_key = (pkey, public_key)
+        except Exception as e:
+            print(f"[SSH] Deployer key unavailable, using password auth: {e}")
+            return None
+
+        return _deployer_key
+
+
+class _OutputTail:
+    """Byte chunks of a stream, keeping only the last max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            self.size -= len(self.chunks.popleft())
+
+    def text(self):
+        return b''.join(self.chunks)[-self.max_bytes:].decode(errors='replace')
+
+
+class _LogLines:
+    """on_output() sink appending a command's output to a shared log file.
+
+    Output is written a line at a time, each tagged with prefix, under lock -
+    several commands can share one file without interleaving mid-line.
+    Partial lines are held back until their newline arrives (or they pass
+    max_pending bytes); close() writes whatever is left.
+    """
+
+    def __init__(self, log, lock, prefix, max_pending=64 * 1024):
+        self.log = log
+        self.lock = lock
+        self.prefix = prefix
+        self.max_pending = max_pending
+        self.pending = b''
+
+    def __call__(self, stream, data):
+        buffer = self.pending + data
+        cut = buffer.rfind(b'\n') + 1
+        if not cut and len(buffer) < self.max_pending:
+            self.pending = buffer
+            return
+        if not cut:
+            cut = len(buffer)
+        self.pending = buffer[cut:]
+        self._write(buffer[:cut])
+
+    def close(self):
+        if self.pending:
+            self._write(self.pending + b'\n')
+            self.pending = b''
+
+    def _write(self, data):
+        lines = b''.join(self.prefix + line for line in data.splitlines(keepends=True))
+        with self.lock:
+            self.log.write(lines)
+            self.log.flush()
+
+
+def exec_command_streaming(ssh, command, timeout=600, on_output=None, max_output=4 * 1024 * 1024):
+    """Run a command over SSH, reading stdout/stderr while it runs.
+
+    Waiting for the exit status before reading can deadlock once the remote
+    side fills the channel window (64KB), so both streams are drained as data
+    arrives. Each chunk is passed to on_output(stream, data) ('stdout' or
+    'stderr', bytes) if given; only the last max_output bytes of each stream
+    are kept for the return value, so verbose installs don't pile up in memory.
+    Returns (exit_code, stdout, stderr); raises socket.timeout if the
+    command runs longer than timeout seconds, and ConnectionError if the
+    connection drops before the command reports an exit status.
+    """
+    transport = ssh.get_transport()
+    chan = transport.open_session()
+    chan.exec_command(command)
+    stdout_tail = _OutputTail(max_output)
+    stderr_tail = _OutputTail(max_output)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            while chan.recv_ready():
+                data = chan.recv(65536)
+                stdout_tail.append(data)
+                if on_output:
+                    on_output('stdout', data)
+            while chan.recv_stderr_ready():
+                data = chan.recv_stderr(65536)
+                stderr_tail.append(data)
+                if on_output:
+                    on_output('stderr', data)
+            if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                break
+            if (chan.closed or not transport.is_active()) and not chan.exit_status_ready():
+                raise ConnectionError('SSH connection lost while the command was running')
+            if time.monotonic() > deadline:
+                raise socket.timeout(f'Command timed out after {timeout}s')
+            select.select([chan], [], [], 1)
+        exit_code = chan.recv_exit_status()
+    finally:
+        chan.close()
+    return exit_code, stdout_tail.text(), stderr_tail.text()
+
+
+def run_remote_script(ssh, script, timeout=600, on_output=None):
+    """Upload a script over SFTP and run it with bash, returning (exit_code, stdout, stderr).
+
+    Keeps the script body off the command line, so quoting and size never
+    matter; the file is removed once bash exits.
+    """
+    path = f'/tmp/bf_{uuid.uuid4().hex}.sh'
+    sftp = ssh.open_sftp()
+    try:
+        with sftp.file(path, 'w') as f:
+            f.write(script)
+    finally:
+        sftp.close()
+
+    return exec_command_streaming(
+        ssh, f'bash {path}; rc=$?; rm -f {path}; exit $rc', timeout=timeout, on_output=on_output
+    )
+
+
+# Per-step completion marker printed by provision_container_batch() scripts
+BATCH_STEP_MARKER = re.compile(rb'__BF_DONE_(\d+)__:(\d+)')
+
+# Download-link patterns on the Microsoft evaluation center pages, in order of preference
+EVAL_ISO_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'https://go\.microsoft\.com/fwlink/\?linkid=\d+',
+    r'https://software-static\.download\.prss\.microsoft\.com/[^"\']+\.iso',
+    r'https://download\.microsoft\.com/[^"\']+\.iso',
+))
+
+# Node-side download-url failures a download through the deployer can get past
+# (the node can't reach or finish fetching the URL); 404s, full storage or
+# permission errors would fail the same way after a multi-GB local download
+NODE_DOWNLOAD_TRANSFER_ERROR = re.compile(
+    r"can't connect|connection (?:refused|reset|closed|timed out)|timed out|timeout"
+    r"|temporary failure in name resolution|name or service not known|could not resolve"
+    r"|network is unreachable|no route to host|ssl|certificate|premature|unexpected eof"
+    r"|\b50[234]\b",
+    re.IGNORECASE
+)
+
+# x64 downloads in Microsoft's product download links, in a single pass over each URI
+WINDOWS_X64_LINK_PATTERN = re.compile(r'x64|amd64', re.IGNORECASE)
+
+
+def find_macos_recovery_url(chunks):
+    """Pick the recovery image URL from Apple's software update catalog.
+
+    chunks is an iterable of catalog bytes (e.g. response.iter_content()),
+    fed to an incremental XML parser: the catalog is a plist, so URLs are
+    the text of <string> elements, with entities already decoded. Parsed
+    elements are cleared as they close, and scanning stops at the first
+    BaseSystem.dmg outside SharedSupport, so the rest of the catalog is
+    never read. Otherwise falls back to the first InstallAssistant package;
+    returns None if neither is listed.
+    """
+    from xml.etree import ElementTree
+
+    parser = ElementTree.XMLPullParser(events=('end',))
+    pkg_url = None
+
+    def scan():
+        nonlocal pkg_url
+        for _, elem in parser.read_events():
+            url = elem.text if elem.tag == 'string' else None
+            elem.clear()
+            if not url or not url.startswith('https://'):
+                continue
+            if url.endswith('BaseSystem.dmg'):
+                if 'SharedSupport' not in url:  # Skip shared support packages
+                    return url
+            elif pkg_url is None and url.endswith('.pkg') and 'InstallAssistant' in url:
+                pkg_url = url
+        return None
+
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            url = scan()
+            if url:
+                return url
+        parser.close()
+        return scan() or pkg_url
+    except ElementTree.ParseError as e:
+        print(f"[MACOS] Malformed software catalog: {e}")
+        return pkg_url
+
+
+# ISO download URLs for various operating systems
+ISO_URLS = MappingProxyType({
+    'debian': 'https://cdimage.debian.org/debian-cd/current/amd64/iso-cd/debian-12.4.0-amd64-netinst.iso',
+    'ubuntu': 'https://releases.ubuntu.com/22.04.3/ubuntu-22.04.3-live-server-amd64.iso',
+    'rocky': 'https://download.rockylinux.org/pub/rocky/9/isos/x86_64/Rocky-9.3-x86_64-minimal.iso',
+    'arch': 'https://geo.mirror.pkgbuild.com/iso/latest/archlinux-x86_64.iso',
+})
+
+# Windows ISO download via Microsoft Software Download API (Fido-style)
+# Product Edition IDs from Microsoft's download portal
+WINDOWS_PRODUCTS = MappingProxyType({
+    'windows-10': MappingProxyType({
+        'product_edition_id': '2618',   # Windows 10 22H2
+        'name': 'Windows 10',
+        'arch': 'x64',
+    }),
+    'windows-11': MappingProxyType({
+        'product_edition_id': '2935',   # Windows 11 24H2
+        'name': 'Windows 11',
+        'arch': 'x64',
+    }),
+    'windows-server-2022': MappingProxyType({
+        'product_edition_id': '2631',   # Windows Server 2022
+        'name': 'Windows Server 2022',
+        'arch': 'x64',
+    }),
+    'windows-server-2025': MappingProxyType({
+        'product_edition_id': '3113',   # Windows Server 2025
+        'name': 'Windows Server 2025',
+        'arch': 'x64',
+    }),
+})
+
+# macOS recovery image board IDs for different versions (used by macrecovery)
+MACOS_BOARD_IDS = MappingProxyType({
+    'sonoma': 'Mac-827FAC58A8FDFA22',      # macOS 14 Sonoma
+    'ventura': 'Mac-4B682C642B45593E',     # macOS 13 Ventura
+    'monterey': 'Mac-E43C1C25D4880AD6',   # macOS 12 Monterey
+    'bigsur': 'Mac-42FD25EABCABB274',     # macOS 11 Big Sur
+})
+
+# LXC container templates
+CT_TEMPLATES = MappingProxyType({
+    'debian': 'debian-12-standard_12.2-1_amd64.tar.zst',
+    'ubuntu': 'ubuntu-22.04-standard_22.04-1_amd64.tar.zst',
+    'rocky': 'rockylinux-9-default_20221109_amd64.tar.xz',
+    'arch': 'archlinux-base_20231015-1_amd64.tar.zst',
+})
+
+# Runner resource configurations
+RUNNER_RESOURCES = MappingProxyType({
+    'windows-10': MappingProxyType({'cores': 4, 'memory': 8192, 'disk': 100, 'type': 'vm'}),
+    'windows-11': MappingProxyType({'cores': 4, 'memory': 8192, 'disk': 100, 'type': 'vm'}),
+    'windows-server-2022': MappingProxyType({'cores': 4, 'memory': 16384, 'disk': 120, 'type': 'vm'}),
+    'windows-server-2025': MappingProxyType({'cores': 4, 'memory': 16384, 'disk': 120, 'type': 'vm'}),
+    'debian': MappingProxyType({'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'}),
+    'ubuntu': MappingProxyType({'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'}),
+    'arch': MappingProxyType({'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'}),
+    'rocky': MappingProxyType({'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'}),
+    'macos': MappingProxyType({'cores': 4, 'memory': 8192, 'disk': 80, 'type': 'vm'}),
+})
+
+WINDOWS_TYPES = frozenset(WINDOWS_PRODUCTS)
+
+# Windows versions that REQUIRE UEFI + TPM 2.0
+WINDOWS_UEFI_TYPES = frozenset({'windows-11', 'windows-server-2025'})
+
+# Fixed create_vm() parameters per guest family (storage-dependent disks are added per call)
+MACOS_OSK = 'ourhardworkbythesewordsguardedpleasedontsteal(c)AppleComputerInc'
+MACOS_QEMU_ARGS = ' '.join([
+    f'-device isa-applesmc,osk={MACOS_OSK}',
+    '-smbios type=2',
+    '-device usb-kbd',
+    '-device usb-tablet',
+    '-global nec-usb-xhci.msi=off',
+    '-cpu host,kvm=on,vendor=GenuineIntel,+kvm_pv_unhalt,+kvm_pv_eoi,+hypervisor,+invtsc'
+])
+MACOS_VM_PARAMS = MappingProxyType({
+    'bios': 'ovmf',
+    'machine': 'q35',
+    'vga': 'vmware',
+    'ostype': 'other',
+    # Note: ISOs should be attached via USB storage in args for UEFI boot
+    # The ISO params are set separately - this args handles the core macOS emulation
+    'args': MACOS_QEMU_ARGS,
+})
+# Windows 11/Server 2025: Must use UEFI
+WINDOWS_UEFI_VM_PARAMS = MappingProxyType({
+    'bios': 'ovmf',
+    'machine': 'q35',
+    'ostype': 'win11',
+})
+# Windows 10/Server 2022: Use SeaBIOS (avoids UEFI boot issues)
+WINDOWS_SEABIOS_VM_PARAMS = MappingProxyType({
+    'bios': 'seabios',
+    'machine': 'pc',
+    'ostype': 'win10',
+})
+
+
 class ProxmoxClient:
     """Client for interacting with Proxmox VE API."""
 
-    # ISO download URLs for various operating systems
-    ISO_URLS = {
-        'debian': 'https://cdimage.debian.org/debian-cd/current/amd64/iso-cd/debian-12.4.0-amd64-netinst.iso',
-        'ubuntu': 'https://releases.ubuntu.com/22.04.3/ubuntu-22.04.3-live-server-amd64.iso',
-        'rocky': 'https://download.rockylinux.org/pub/rocky/9/isos/x86_64/Rocky-9.3-x86_64-minimal.iso',
-        'arch': 'https://geo.mirror.pkgbuild.com/iso/latest/archlinux-x86_64.iso',
-    }
-
-    # Windows ISO download via Microsoft Software Download API (Fido-style)
-    # Product Edition IDs from Microsoft's download portal
-    WINDOWS_PRODUCTS = {
-        'windows-10': {
-            'product_edition_id': '2618',   # Windows 10 22H2
-            'name': 'Windows 10',
-            'arch': 'x64',
-        },
-        'windows-11': {
-            'product_edition_id': '2935',   # Windows 11 24H2
-            'name': 'Windows 11',
-            'arch': 'x64',
-        },
-        'windows-server-2022': {
-            'product_edition_id': '2631',   # Windows Server 2022
-            'name': 'Windows Server 2022',
-            'arch': 'x64',
-        },
-        'windows-server-2025': {
-            'product_edition_id': '3113',   # Windows Server 2025
-            'name': 'Windows Server 2025',
-            'arch': 'x64',
-        },
-    }
-
-    # macOS recovery image board IDs for different versions (used by macrecovery)
-    MACOS_BOARD_IDS = {
-        'sonoma': 'Mac-827FAC58A8FDFA22',      # macOS 14 Sonoma
-        'ventura': 'Mac-4B682C642B45593E',     # macOS 13 Ventura
-        'monterey': 'Mac-E43C1C25D4880AD6',   # macOS 12 Monterey
-        'bigsur': 'Mac-42FD25EABCABB274',     # macOS 11 Big Sur
-    }
-
-    # LXC container templates
-    CT_TEMPLATES = {
-        'debian': 'debian-12-standard_12.2-1_amd64.tar.zst',
-        'ubuntu': 'ubuntu-22.04-standard_22.04-1_amd64.tar.zst',
-        'rocky': 'rockylinux-9-default_20221109_amd64.tar.xz',
-        'arch': 'archlinux-base_20231015-1_amd64.tar.zst',
-    }
-
-    # Runner resource configurations
-    RUNNER_RESOURCES = {
-        'windows-10': {'cores': 4, 'memory': 8192, 'disk': 100, 'type': 'vm'},
-        'windows-11': {'cores': 4, 'memory': 8192, 'disk': 100, 'type': 'vm'},
-        'windows-server-2022': {'cores': 4, 'memory': 16384, 'disk': 120, 'type': 'vm'},
-        'windows-server-2025': {'cores': 4, 'memory': 16384, 'disk': 120, 'type': 'vm'},
-        'debian': {'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'},
-        'ubuntu': {'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'},
-        'arch': {'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'},
-        'rocky': {'cores': 2, 'memory': 4096, 'disk': 40, 'type': 'lxc'},
-        'macos': {'cores': 4, 'memory': 8192, 'disk': 80, 'type': 'vm'},
-    }
-
-    def __init__(self, host, port=8006, user=None, password=None, token_name=None, token_value=None, verify_ssl=False):
+    # Lookup tables (read-only; see the module-level constants)
+    ISO_URLS = ISO_URLS
+    WINDOWS_PRODUCTS = WINDOWS_PRODUCTS
+    MACOS_BOARD_IDS = MACOS_BOARD_IDS
+    CT_TEMPLATES = CT_TEMPLATES
+    RUNNER_RESOURCES = RUNNER_RESOURCES
+
+    # VMID allocation: how long a cluster listing is trusted, and how long an
+    # allocated-but-never-created VMID stays reserved
+    VMID_CACHE_TTL = 30
+    VMID_RESERVATION_TTL = 600
+
+    # Proxmox version info per (host, port) - only changes on a PVE upgrade
+    _version_cache = {}
+
+    # VMID allocation state per (host, port), shared by every client in the
+    # process: the last used-ID listing, when it was taken, and the VMIDs
+    # handed out but not yet seen in it - see get_next_vmids()
+    _vmid_state = {}
+    _vmid_lock = threading.Lock()
+
+    # In-flight download_iso_to_proxmox() calls per (host, node, storage, filename),
+    # shared by every client in the process; later callers wait on the Future
+    _iso_downloads = {}
+    _iso_downloads_guard = threading.Lock()
+
+    def __init__(self, host, port=8006, user=None, password=None, token_name=None, token_value=None, verify_ssl=False,
+                 api_timeout=30):
         self.host = host
         self.port = port
         self.user = user
@@ -117,7 +695,21 @@ class ProxmoxClient:
         self.token_name = token_name
         self.token_value = token_value
         self.verify_ssl = verify_ssl
+        # Seconds per API request; proxmoxer's 5s default is too short for busy clusters
+        self.api_timeout = api_timeout
         self.proxmox = None
+        self._node_handles = {}
+        self._lxc_handles = {}
+        self._qemu_handles = {}
+        self._container_ips = {}
+        self._node_ips = {}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._image_handlers = {
+            **{vm_type: self._ensure_linux_iso for vm_type in ISO_URLS},
+            **{vm_type: self._ensure_windows_iso for vm_type in WINDOWS_TYPES},
+            'macos': self._ensure_macos_recovery,
+        }
 
     def connect(self):
         """Establish connection to Proxmox API."""
@@ -130,7 +722,8 @@ class ProxmoxClient:
                 user=self.user,
                 token_name=self.token_name,
                 token_value=self.token_value,
-                verify_ssl=self.verify_ssl
+                verify_ssl=self.verify_ssl,
+                timeout=self.api_timeout
             )
         else:
             self.proxmox = ProxmoxAPI(
@@ -138,139 +731,413 @@ class ProxmoxClient:
                 port=self.port,
                 user=self.user,
                 password=self.password,
-                verify_ssl=self.verify_ssl
+                verify_ssl=self.verify_ssl,
+                timeout=self.api_timeout
             )
+        self._tune_api_session()
+        with self._vmid_lock:
+            state = self._vmid_state.get((self.host, self.port))
+            if state:
+                state['used'] = None
+        self._node_handles = {}
+        self._lxc_handles = {}
+        self._qemu_handles = {}
+        self.invalidate_cache()
         return self
 
+    def _node_changed(self, node):
+        """Drop cached node reads after a guest was created on it (memory/disk usage moved)."""
+        self.invalidate_cache('get_node_status', node)
+        self.invalidate_cache('get_storage_pools', node)
+        self.invalidate_cache('get_cluster_snapshot')
+
+    def _tune_api_session(self):
+        """Give proxmoxer's requests.Session a bigger keep-alive pool and GET retries.
+
+        proxmoxer already reuses one session per ProxmoxAPI, but its default
+        pool holds 10 connections, so parallel callers (ensure_vm_images,
+        provision_many) kept opening fresh TLS
+        connections. Only idempotent GETs are retried on 5xx/connection errors.
+        """
+        session = getattr(self.proxmox, '_store', {}).get('session')
+        if session is None:
+            return
+        requests = _get_requests()
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=('GET',), raise_on_status=False)
+        session.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=8, pool_maxsize=32, max_retries=retry
+        ))
+
+    def invalidate_cache(self, method_name=None, *args):
+        """Drop cached read results - all of them, one method's, or one call's."""
+        with self._cache_lock:
+            if method_name is None:
+                self._cache.clear()
+                return
+            for key in list(self._cache):
+                if key[0] == method_name and key[1][:len(args)] == args:
+                    del self._cache[key]
+
+    def get_version(self, refresh=False):
+        """Get the Proxmox version info, cached per host for the life of the process."""
+        key = (self.host, self.port)
+        version = self._version_cache.get(key)
+        if version is None or refresh:
+            version = self._version_cache[key] = self.proxmox.version.get()
+        return version
+
     def test_connection(self):
         """Test the connection and return version info."""
-        version = self.proxmox.version.get()
+        version = self.get_version()
         return {'success': True, 'version': version.get('version')}
 
+    @ttl_cached(30)
     def get_nodes(self):
-        """Get list of available nodes."""
-        return [node['node'] for node in self.proxmox.nodes.get()]
+        """Get list of available nodes.
+
+        Reads /cluster/status, which is cheaper than /nodes and also carries
+        each node's management IP (remembered for _node_host()).
+        """
+        try:
+            members = [r for r in self.proxmox.cluster.status.get() if r.get('type') == 'node']
+        except Exception:
+            members = []
+        if not members:
+            # Token without Sys.Audit, or an older PVE - fall back to /nodes
+            return [node['node'] for node in self.proxmox.nodes.get()]
+
+        self._node_ips.update({r['name']: r['ip'] for r in members if r.get('ip')})
+        return [r['name'] for r in members]
+
+    def _node_host(self, node):
+        """Address to SSH to for commands that must run on `node` (e.g. pct)."""
+        if node not in self._node_ips:
+            try:
+                self.get_nodes()
+            except Exception:
+                pass
+        return self._node_ips.get(node, self.host)
 
+    @ttl_cached(10, allow_stale=True)
     def get_node_status(self, node):
         """Get node status including CPU, memory, storage."""
-        status = self.proxmox.nodes(node).status.get()
+        status = self._node(node).status.get()
+        cpuinfo = status.get('cpuinfo') or {}
+        memory = status.get('memory') or {}
         return {
-            'cpu_cores': status.get('cpuinfo', {}).get('cpus', 0),
-            'memory_total': status.get('memory', {}).get('total', 0),
-            'memory_used': status.get('memory', {}).get('used', 0),
+            'cpu_cores': cpuinfo.get('cpus', 0),
+            'memory_total': memory.get('total', 0),
+            'memory_used': memory.get('used', 0),
         }
 
+    @ttl_cached(5, allow_stale=True)
+    def get_cluster_snapshot(self):
+        """Every guest in the cluster from one cluster/resources call, as {vmid: entry}.
+
+        Entries carry node, type ('lxc'/'qemu'), name, status, cpu, mem and
+        uptime - enough for overviews and batch waits, which then cost one
+        API call instead of one status call per guest.
+        """
+        return {r['vmid']: r for r in self.proxmox.cluster.resources.get(type='vm')}
+
+    @ttl_cached(30)
     def get_storage_pools(self, node, content_type=None):
         """Get available storage pools."""
-        storages = self.proxmox.nodes(node).storage.get()
+        storages = self._node(node).storage.get()
         if content_type:
             storages = [s for s in storages if content_type in s.get('content', '')]
         return storages
 
-    def get_next_vmid(self):
-        """Get next available VMID."""
-        cluster_resources = self.proxmox.cluster.resources.get(type='vm')
-        used_ids = {r['vmid'] for r in cluster_resources}
-        vmid = 100
-        while vmid in used_ids:
-            vmid += 1
-        return vmid
+    def get_next_vmid(self, reuse_gaps=False):
+        """Get next available VMID.
+
+        Returns one past the highest VMID in the cluster (or 100 on an empty
+        one), so freed low IDs aren't handed out again. With reuse_gaps=True,
+        returns the lowest free ID from 100 up instead. See get_next_vmids().
+        """
+        return self.get_next_vmids(1, reuse_gaps)[0]
+
+    def get_next_vmids(self, count, reuse_gaps=False):
+        """Allocate count distinct VMIDs from a single cluster listing.
+
+        The used-ID set is fetched at most every VMID_CACHE_TTL seconds, and
+        returned IDs are reserved right away, so parallel or back-to-back
+        callers get distinct IDs without re-querying the cluster. Reservations
+        are dropped once the guest shows up in the listing (or after
+        VMID_RESERVATION_TTL seconds if it never gets created). The listing
+        and reservations are shared by all clients for the same cluster, so
+        concurrent deployments don't collide either.
+        """
+        with self._vmid_lock:
+            state = self._vmid_state.setdefault(
+                (self.host, self.port), {'used': None, 'at': 0.0, 'reserved': {}}
+            )
+            reserved = state['reserved']
+            now = time.monotonic()
+            if state['used'] is None or now - state['at'] > self.VMID_CACHE_TTL:
+                self.invalidate_cache('get_cluster_snapshot')
+                state['used'] = set(self.get_cluster_snapshot())
+                state['at'] = now
+                for vmid, reserved_at in list(reserved.items()):
+                    if vmid in state['used'] or now - reserved_at >= self.VMID_RESERVATION_TTL:
+                        del reserved[vmid]
+
+            taken = state['used'].union(reserved)
+            vmids = []
+            vmid = 100 if reuse_gaps else max(taken, default=99) + 1
+            while len(vmids) < count:
+                if vmid not in taken:
+                    vmids.append(vmid)
+                    reserved[vmid] = now
+                vmid += 1
+            return vmids
 
     def download_iso_to_proxmox(self, node, storage, url, filename, callback=None):
-        """Download ISO directly to Proxmox storage."""
-        task = self.proxmox.nodes(node).storage(storage)('download-url').post(
-            url=url,
-            filename=filename,
-            content='iso'
-        )
-        return self.wait_for_task(node, task, callback)
+        """Download ISO directly to Proxmox storage.
+
+        If the download task can't be started, or the node fails to fetch the
+        URL for network/transfer reasons, the ISO is fetched here instead
+        (resumable, see download_resumable) and uploaded to the storage. Other
+        failures (404, full storage, ...) and timeouts are returned as-is.
+        A download of the same file to the same storage that is already in
+        progress (from any client in this process) is waited for and its
+        result shared, rather than started a second time.
+        """
+        key = (self.host, node, storage, filename)
+        with self._iso_downloads_guard:
+            in_flight = self._iso_downloads.get(key)
+            if in_flight is None:
+                in_flight = self._iso_downloads[key] = Future()
+                owner = True
+            else:
+                owner = False
 
-    def wait_for_task(self, node, task_id, callback=None, timeout=3600):
-        """Wait for a Proxmox task to complete."""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            status = self.proxmox.nodes(node).tasks(task_id).status.get()
+        if not owner:
             if callback:
-                callback(status)
-            if status['status'] == 'stopped':
-                if status.get('exitstatus') == 'OK':
-                    return {'success': True, 'task': task_id}
-                else:
-                    return {'success': False, 'error': status.get('exitstatus', 'Task failed')}
-            time.sleep(2)
-        return {'success': False, 'error': 'Task timed out'}
+                callback({'status': 'downloading', 'message': f'Waiting for download of {filename} already in progress...'})
+            return in_flight.result()
+
+        result = None
+        try:
+            result = self._download_iso_to_proxmox(node, storage, url, filename, callback)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        finally:
+            with self._iso_downloads_guard:
+                del self._iso_downloads[key]
+            # Always resolve, even if a BaseException is unwinding, so waiters never hang
+            in_flight.set_result(result if result is not None else
+                                 {'success': False, 'error': f'Download of {filename} was interrupted'})
+        return result
+
+    def _download_iso_to_proxmox(self, node, storage, url, filename, callback=None):
+        try:
+            task = self._node(node).storage(storage)('download-url').post(
+                url=url,
+                filename=filename,
+                content='iso'
+            )
+        except Exception as e:
+            # The node never got the download - fetch it here instead
+            print(f"[DOWNLOAD] Proxmox download of {filename} could not be started ({e}), "
+                  f"retrying through the deployer")
+            result = self._download_and_upload_iso(node, storage, url, filename, callback)
+        else:
+            result = self.wait_for_task(node, task, callback, poll_interval=2.0)
+            # A timed-out task may still be running on the node - don't upload next to it
+            if (not result.get('success') and not result.get('timed_out')
+                    and NODE_DOWNLOAD_TRANSFER_ERROR.search(str(result.get('error', '')))):
+                print(f"[DOWNLOAD] Proxmox download of {filename} failed ({result.get('error')}), "
+                      f"retrying through the deployer")
+                result = self._download_and_upload_iso(node, storage, url, filename, callback)
+        self.invalidate_cache('get_storage_content', node, storage)
+        return result
+
+    def _download_and_upload_iso(self, node, storage, url, filename, callback=None):
+        """Fetch an ISO locally with Range resume, then upload it to Proxmox storage.
+
+        The partial file is kept under data/downloads/ on failure, so the next
+        attempt for the same ISO continues where this one stopped.
+        """
+        from .models import DATA_DIR
+
+        download_dir = DATA_DIR / 'downloads'
+        download_dir.mkdir(parents=True, exist_ok=True)
+        local_path = download_dir / filename
+
+        def progress(done, total):
+            if callback:
+                message = f'Downloading {filename}: {done // (1024 * 1024)} MiB'
+                if total:
+                    message += f' of {total // (1024 * 1024)} MiB'
+                callback({'status': 'downloading', 'message': message})
+
+        if not download_resumable(url, str(local_path), on_progress=progress if callback else None):
+            return {'success': False, 'error': f'Download of {filename} failed (partial file kept for resume)'}
+
+        try:
+            if callback:
+                callback({'status': 'uploading', 'message': f'Uploading {filename} to {storage}...'})
+            with open(local_path, 'rb') as f:
+                task = self._node(node).storage(storage).upload.post(content='iso', filename=f)
+            result = self.wait_for_task(node, task, callback, poll_interval=2.0)
+        except Exception as e:
+            return {'success': False, 'error': f'Upload of {filename} failed: {e}'}
+
+        if result.get('success'):
+            local_path.unlink(missing_ok=True)
+        return result
+
+    def wait_for_task(self, node, task_id, callback=None, timeout=3600,
+                      poll_interval=0.25, max_poll_interval=15.0, fast_polls=3):
+        """Wait for a Proxmox task to complete.
+
+        The first fast_polls polls are poll_interval apart, then the interval
+        backs off (x1.5) to at most max_poll_interval, so short tasks return
+        quickly and hour-long downloads don't cost thousands of API calls.
+        Callers with known-slow tasks raise poll_interval. With a callback, each poll reads the task log
+        instead: while new lines keep arriving (and none is the final
+        "TASK ..." line) the task is running, and the status call is skipped.
+        Each status passed to the callback carries 'log': the task log lines
+        written since the previous poll.
+        """
+        task = self._node(node).tasks(task_id)
+        task_status = task.status
+        task_log = task.log
+        deadline = time.monotonic() + timeout
+        delay = poll_interval
+        polls = 0
+        log_offset = 0
+        while True:
+            log = []
+            if callback:
+                try:
+                    lines = task_log.get(start=log_offset, limit=200)
+                except Exception:
+                    lines = []
+                # An empty read comes back as a single "no content" entry
+                if lines and not (len(lines) == 1 and lines[0].get('t') == 'no content'):
+                    log_offset = lines[-1].get('n', log_offset + len(lines))
+                    log = [line.get('t', '') for line in lines]
+
+            if log and not any(line.startswith('TASK ') for line in log):
+                callback({'status': 'running', 'log': log})
+            else:
+                status = task_status.get()
+                if callback:
+                    status['log'] = log
+                    callback(status)
+                if status['status'] == 'stopped':
+                    if status.get('exitstatus') == 'OK':
+                        return {'success': True, 'task': task_id}
+                    else:
+                        return {'success': False, 'error': status.get('exitstatus', 'Task failed')}
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {'success': False, 'error': 'Task timed out', 'timed_out': True}
+            time.sleep(min(delay, remaining))
+            polls += 1
+            if polls >= fast_polls:
+                delay = min(delay * 1.5, max_poll_interval)
+
+    @ttl_cached(30, allow_stale=True)
+    def get_storage_content(self, node, storage):
+        """Get the content listing of a storage (ISOs, templates, images, ...)."""
+        return self._node(node).storage(storage).content.get()
 
     def get_available_isos(self, node, storage):
         """Get list of available ISOs in storage."""
         try:
-            content = self.proxmox.nodes(node).storage(storage).content.get()
+            content = self.get_storage_content(node, storage)
             return [item for item in content if item.get('content') == 'iso']
         except Exception:
             return []
 
+    def get_iso_index(self, node, storage):
+        """Get ISOs in storage keyed by volid (for O(1) existence checks)."""
+        return {iso.get('volid', ''): iso for iso in self.get_available_isos(node, storage)}
+
     def get_available_templates(self, node, storage='local'):
         """Get list of available container templates."""
         try:
-            content = self.proxmox.nodes(node).storage(storage).content.get()
+            content = self.get_storage_content(node, storage)
             return [item for item in content if item.get('content') == 'vztmpl']
         except Exception:
             return []
 
     def download_template(self, node, storage, template):
         """Download a container template."""
-        task = self.proxmox.nodes(node).storage(storage)('download-url').post(
+        task = self._node(node).storage(storage)('download-url').post(
             url=f'http://download.proxmox.com/images/system/{template}',
             filename=template,
             content='vztmpl'
         )
-        return self.wait_for_task(node, task)
+        result = self.wait_for_task(node, task, poll_interval=1.0)
+        self.invalidate_cache('get_storage_content', node, storage)
+        return result
 
     # =========================================================================
     # Windows ISO Auto-Download (Microsoft Software Download API - Fido-style)
     # =========================================================================
 
-    def get_windows_iso(self, node, storage, windows_type, callback=None):
+    def get_windows_iso(self, node, storage, windows_type, callback=None, existing_index=None):
         """
         Automatically download Windows ISO using Microsoft's Software Download API.
         Uses the same approach as Fido/Rufus to get official download links.
         Returns the ISO path in Proxmox storage format.
+
+        existing_index: optional {volid: iso} map from get_iso_index() to skip
+        re-listing the storage content.
         """
-        import uuid
-        import re
         requests = _get_requests()
+        http = get_http_session()
 
-        if windows_type not in self.WINDOWS_PRODUCTS:
+        if windows_type not in WINDOWS_PRODUCTS:
             return {'success': False, 'error': f'Unknown Windows type: {windows_type}'}
 
-        product = self.WINDOWS_PRODUCTS[windows_type]
+        product = WINDOWS_PRODUCTS[windows_type]
         iso_filename = f'{windows_type}.iso'
 
-        # Check if ISO already exists
-        existing_isos = self.get_available_isos(node, storage)
-        for iso in existing_isos:
-            if iso_filename in iso.get('volid', ''):
-                return {'success': True, 'iso': iso['volid'], 'cached': True}
+        # Microsoft Software Download API endpoints
+        session_id = str(uuid.uuid4())
+        locale = 'en-US'
+        profile = '606624d44113'
+
+        # Common headers - simulate Edge browser on Windows
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
+            'Accept': 'application/json',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Referer': f'https://www.microsoft.com/{locale.lower()}/software-download/windows10ISO',
+        }
+        whitelist_url = f'https://vlscppe.microsoft.com/tags?org_id=y6jn8c31&session_id={session_id}'
+
+        # Check if ISO already exists. When the storage has to be listed, the
+        # (cheap) session whitelist call runs alongside it; a cache hit just
+        # leaves it unused.
+        whitelist_future = None
+        if existing_index is None:
+            executor = ThreadPoolExecutor(max_workers=1)
+            whitelist_future = executor.submit(http.get, whitelist_url, headers=headers, timeout=30)
+            executor.shutdown(wait=False)
+            existing_index = self.get_iso_index(node, storage)
+        iso_volid = f'{storage}:iso/{iso_filename}'
+        if iso_volid in existing_index:
+            return {'success': True, 'iso': iso_volid, 'cached': True}
 
         if callback:
             callback({'status': 'fetching', 'message': f'Fetching {product["name"]} download info from Microsoft...'})
 
         try:
-            # Microsoft Software Download API endpoints
-            session_id = str(uuid.uuid4())
-            locale = 'en-US'
-            profile = '606624d44113'
-
-            # Common headers - simulate Edge browser on Windows
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
-                'Accept': 'application/json',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Referer': f'https://www.microsoft.com/{locale.lower()}/software-download/windows10ISO',
-            }
-
             # Step 1: Whitelist the session for downloads
-            whitelist_url = f'https://vlscppe.microsoft.com/tags?org_id=y6jn8c31&session_id={session_id}'
-            requests.get(whitelist_url, headers=headers, timeout=30)
+            if whitelist_future is not None:
+                whitelist_future.result()
+            else:
+                http.get(whitelist_url, headers=headers, timeout=30)
 
             if callback:
                 callback({'status': 'fetching', 'message': f'Getting available languages for {product["name"]}...'})
@@ -286,13 +1153,13 @@ class ProxmoxClient:
                 'sessionID': session_id,
             }
 
-            sku_response = requests.get(sku_url, params=sku_params, headers=headers, timeout=30)
+            sku_response = http.get(sku_url, params=sku_params, headers=headers, timeout=30)
 
             if sku_response.status_code != 200:
                 return self._fallback_windows_download(node, storage, windows_type, iso_filename, callback,
                                                        f'SKU request failed: {sku_response.status_code}')
 
-            sku_data = sku_response.json()
+            sku_data = response_json(sku_response)
 
             # Find English (US) SKU ID
             sku_id = None
@@ -330,13 +1197,13 @@ class ProxmoxClient:
                 'sessionID': session_id,
             }
 
-            download_response = requests.get(download_url, params=download_params, headers=headers, timeout=30)
+            download_response = http.get(download_url, params=download_params, headers=headers, timeout=30)
 
             if download_response.status_code != 200:
                 return self._fallback_windows_download(node, storage, windows_type, iso_filename, callback,
                                                        f'Download request failed: {download_response.status_code}')
 
-            download_data = download_response.json()
+            download_data = response_json(download_response)
 
             # Find x64 ISO download link
             iso_url = None
@@ -344,7 +1211,7 @@ class ProxmoxClient:
             for link in product_links:
                 uri = link.get('Uri', '')
                 # Prefer x64 architecture
-                if 'x64' in uri.lower() or 'amd64' in uri.lower():
+                if WINDOWS_X64_LINK_PATTERN.search(uri):
                     iso_url = uri
                     break
             # Fallback to any ISO link
@@ -411,8 +1278,7 @@ class ProxmoxClient:
         Try to get Windows Server evaluation download link from Microsoft's evaluation center.
         Returns the direct download URL if found, None otherwise.
         """
-        import re
-        requests = _get_requests()
+        http = get_http_session()
 
         eval_pages = {
             'windows-server-2022': 'https://www.microsoft.com/en-us/evalcenter/download-windows-server-2022',
@@ -428,20 +1294,14 @@ class ProxmoxClient:
                 'Accept': 'text/html,application/xhtml+xml',
             }
 
-            response = requests.get(eval_pages[windows_type], headers=headers, timeout=30)
+            response = http.get(eval_pages[windows_type], headers=headers, timeout=30)
             if response.status_code != 200:
                 return None
 
             # Look for ISO download links in the page
             # Microsoft evaluation center uses various patterns for download links
-            iso_patterns = [
-                r'https://go\.microsoft\.com/fwlink/\?linkid=\d+',
-                r'https://software-static\.download\.prss\.microsoft\.com/[^"\']+\.iso',
-                r'https://download\.microsoft\.com/[^"\']+\.iso',
-            ]
-
-            for pattern in iso_patterns:
-                matches = re.findall(pattern, response.text, re.IGNORECASE)
+            for pattern in EVAL_ISO_PATTERNS:
+                matches = pattern.findall(response.text)
                 if matches:
                     # Filter for x64/amd64 versions
                     for match in matches:
@@ -459,24 +1319,29 @@ class ProxmoxClient:
     # macOS Recovery Image (No ISO needed - uses Apple's recovery servers)
     # =========================================================================
 
-    def get_macos_recovery(self, node, storage, version='ventura', callback=None):
+    def get_macos_recovery(self, node, storage, version='ventura', callback=None, existing_index=None):
         """
         Download macOS recovery image using macrecovery method.
         This downloads directly from Apple's servers without needing an ISO.
         Returns path to the recovery image in Proxmox storage.
+
+        existing_index: optional {volid: iso} map from get_iso_index() to skip
+        re-listing the storage content.
         """
         requests = _get_requests()
-        if version not in self.MACOS_BOARD_IDS:
+        http = get_http_session()
+        if version not in MACOS_BOARD_IDS:
             return {'success': False, 'error': f'Unknown macOS version: {version}'}
 
-        board_id = self.MACOS_BOARD_IDS[version]
+        board_id = MACOS_BOARD_IDS[version]
         recovery_filename = f'macos-{version}-recovery.dmg'
 
         # Check if recovery image already exists
-        existing_isos = self.get_available_isos(node, storage)
-        for iso in existing_isos:
-            if recovery_filename in iso.get('volid', '') or f'macos-{version}' in iso.get('volid', ''):
-                return {'success': True, 'iso': iso['volid'], 'cached': True}
+        if existing_index is None:
+            existing_index = self.get_iso_index(node, storage)
+        for volid in existing_index:
+            if recovery_filename in volid or f'macos-{version}' in volid:
+                return {'success': True, 'iso': volid, 'cached': True}
 
         if callback:
             callback({'status': 'fetching', 'message': f'Fetching macOS {version} recovery catalog...'})
@@ -500,53 +1365,15 @@ class ProxmoxClient:
                 'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)',
             }
 
-            catalog_response = requests.get(catalog_url, headers=headers, timeout=60)
-            if catalog_response.status_code != 200:
-                return {'success': False, 'error': 'Failed to fetch Apple software catalog'}
-
-            catalog_content = catalog_response.text
-
-            # Parse catalog to find InstallAssistant packages
-            # Look for BaseSystem.dmg or RecoveryImage.dmg URLs
-            import re
-
-            # Find all package URLs that contain recovery/installer images
-            version_names = {
-                'sonoma': '14',
-                'ventura': '13',
-                'monterey': '12',
-                'bigsur': '11',
-            }
-
-            target_version = version_names.get(version, '14')
-
-            # Look for InstallAssistant or macOS Installer packages
-            pkg_pattern = rf'(https://[^<]+InstallAssistant[^<]*\.pkg)'
-            dmg_pattern = rf'(https://[^<]+BaseSystem\.dmg)'
-            chunklist_pattern = rf'(https://[^<]+BaseSystem\.chunklist)'
-
-            pkg_matches = re.findall(pkg_pattern, catalog_content)
-            dmg_matches = re.findall(dmg_pattern, catalog_content)
-
-            recovery_url = None
-            chunklist_url = None
-
-            # Prefer BaseSystem.dmg for recovery boot
-            for dmg_url in dmg_matches:
-                if 'SharedSupport' not in dmg_url:  # Skip shared support packages
-                    recovery_url = dmg_url
-                    # Try to find matching chunklist
-                    chunklist = dmg_url.replace('BaseSystem.dmg', 'BaseSystem.chunklist')
-                    if chunklist in catalog_content:
-                        chunklist_url = chunklist
-                    break
-
-            # If no BaseSystem.dmg, look for the full installer
-            if not recovery_url and pkg_matches:
-                # Filter for the correct macOS version
-                for pkg_url in pkg_matches:
-                    recovery_url = pkg_url
-                    break
+            # Stream the catalog; the scan stops (and the download is dropped)
+            # at the first usable BaseSystem.dmg
+            catalog_response = http.get(catalog_url, headers=headers, timeout=60, stream=True)
+            try:
+                if catalog_response.status_code != 200:
+                    return {'success': False, 'error': 'Failed to fetch Apple software catalog'}
+                recovery_url = find_macos_recovery_url(catalog_response.iter_content(chunk_size=65536))
+            finally:
+                catalog_response.close()
 
             if not recovery_url:
                 # Fallback: Use known working recovery image URLs
@@ -588,7 +1415,7 @@ class ProxmoxClient:
         - Requires Intel CPU (AMD is not reliably supported for macOS VMs)
         - VirtIO disks are NOT visible in macOS Recovery - use SATA instead
         """
-        requests = _get_requests()
+        http = get_http_session()
         if callback:
             callback({'status': 'preparing', 'message': 'Preparing KVM-optimized OpenCore bootloader...'})
 
@@ -598,11 +1425,11 @@ class ProxmoxClient:
             oc_release_url = 'https://api.github.com/repos/thenickdude/KVM-Opencore/releases/latest'
             headers = {'Accept': 'application/vnd.github.v3+json'}
 
-            release_response = requests.get(oc_release_url, headers=headers, timeout=30)
+            release_response = http.get(oc_release_url, headers=headers, timeout=30)
             if release_response.status_code != 200:
                 return {'success': False, 'error': 'Failed to fetch KVM-Opencore release info'}
 
-            release_data = release_response.json()
+            release_data = response_json(release_response)
             release_version = release_data.get('tag_name', 'unknown')
 
             # Find the ISO file (pre-built bootable OpenCore image)
@@ -635,37 +1462,55 @@ class ProxmoxClient:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    def ensure_vm_images(self, vm_types, node, storage, callback=None, max_parallel=4):
+        """Ensure images for several VM types, downloading missing ones in parallel.
+
+        Returns {vm_type: ensure_vm_image() result}; duplicate types are fetched once.
+        """
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = {
+                executor.submit(self.ensure_vm_image, node, storage, vm_type, callback): vm_type
+                for vm_type in set(vm_types)
+            }
+            return {futures[future]: future.result() for future in as_completed(futures)}
+
     def ensure_vm_image(self, node, storage, vm_type, callback=None):
         """
         Ensure the required image (ISO/recovery) is available for a VM type.
         Automatically downloads if not present.
         """
-        # Linux ISOs
-        if vm_type in self.ISO_URLS:
-            iso_filename = f'{vm_type}.iso'
-            existing = self.get_available_isos(node, storage)
-            for iso in existing:
-                if vm_type in iso.get('volid', ''):
-                    return {'success': True, 'iso': iso['volid'], 'cached': True}
+        handler = self._image_handlers.get(vm_type)
+        if handler is None:
+            return {'success': False, 'error': f'Unknown VM type: {vm_type}'}
 
-            if callback:
-                callback({'status': 'downloading', 'message': f'Downloading {vm_type} ISO...'})
-            result = self.download_iso_to_proxmox(
-                node, storage, self.ISO_URLS[vm_type], iso_filename, callback
-            )
-            if result.get('success'):
-                result['iso'] = f'{storage}:iso/{iso_filename}'
-            return result
+        # Concurrent callers for the same image share one download (see
+        # download_iso_to_proxmox)
+        return handler(node, storage, vm_type, callback, self.get_iso_index(node, storage))
+
+    # ensure_vm_image() handlers: (node, storage, vm_type, callback, existing_index) -> result
+
+    def _ensure_linux_iso(self, node, storage, vm_type, callback, existing_index):
+        """Download a Linux ISO unless one for the distro is already in storage."""
+        iso_filename = f'{vm_type}.iso'
+        for volid in existing_index:
+            if vm_type in volid:
+                return {'success': True, 'iso': volid, 'cached': True}
 
-        # Windows ISOs
-        if vm_type.startswith('windows'):
-            return self.get_windows_iso(node, storage, vm_type, callback)
+        if callback:
+            callback({'status': 'downloading', 'message': f'Downloading {vm_type} ISO...'})
+        result = self.download_iso_to_proxmox(
+            node, storage, ISO_URLS[vm_type], iso_filename, callback
+        )
+        if result.get('success'):
+            result['iso'] = f'{storage}:iso/{iso_filename}'
+        return result
 
-        # macOS - default to Ventura (most reliable for KVM)
-        if vm_type == 'macos':
-            return self.get_macos_recovery(node, storage, 'ventura', callback)
+    def _ensure_windows_iso(self, node, storage, vm_type, callback, existing_index):
+        return self.get_windows_iso(node, storage, vm_type, callback, existing_index=existing_index)
 
-        return {'success': False, 'error': f'Unknown VM type: {vm_type}'}
+    def _ensure_macos_recovery(self, node, storage, vm_type, callback, existing_index):
+        # Default to Ventura (most reliable for KVM)
+        return self.get_macos_recovery(node, storage, 'ventura', callback, existing_index=existing_index)
 
     # =========================================================================
     # Windows Unattended Installation (autounattend.xml)
@@ -682,11 +1527,10 @@ class ProxmoxClient:
         custom_iso_name = f'{windows_type}-unattended.iso'
 
         # Check if custom ISO already exists with same config
-        existing_isos = self.get_available_isos(node, storage)
-        for iso in existing_isos:
-            if custom_iso_name in iso.get('volid', ''):
-                # Custom ISO exists - could add hash check for config changes
-                return {'success': True, 'iso': iso['volid'], 'cached': True}
+        custom_iso_volid = f'{storage}:iso/{custom_iso_name}'
+        if custom_iso_volid in self.get_iso_index(node, storage):
+            # Custom ISO exists - could add hash check for config changes
+            return {'success': True, 'iso': custom_iso_volid, 'cached': True}
 
         # First ensure we have the base Windows ISO
         if callback:
@@ -715,12 +1559,7 @@ class ProxmoxClient:
         post_install_script = self._get_windows_runner_setup_script(gitlab_url, runner_token)
 
         # SSH to Proxmox host to create the custom ISO
-        paramiko = _get_paramiko()
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(self.host, username='root', password=self.password, timeout=30)
-
             # Determine storage path
             storage_path = f'/var/lib/vz/template/iso'
 
@@ -793,12 +1632,9 @@ rm -rf "$WORK_DIR"
 echo "SUCCESS: $OUTPUT_ISO"
 '''
 
-            stdin, stdout, stderr = ssh.exec_command(create_iso_script, timeout=600)
-            exit_code = stdout.channel.recv_exit_status()
-            output = stdout.read().decode()
-            errors = stderr.read().decode()
-
-            ssh.close()
+            with ssh_pool.session(self.host, 'root', self.password, timeout=30) as ssh:
+                exit_code, output, errors = run_remote_script(ssh, create_iso_script, timeout=600)
+            self.invalidate_cache('get_storage_content', node, storage)
 
             if exit_code == 0 and 'SUCCESS:' in output:
                 return {'success': True, 'iso': f'{storage}:iso/{custom_iso_name}'}
@@ -827,12 +1663,7 @@ echo "SUCCESS: $OUTPUT_ISO"
             dns=dns
         )
 
-        paramiko = _get_paramiko()
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(self.host, username='root', password=self.password, timeout=30)
-
             # Determine storage path for ISOs
             storage_path = '/var/lib/vz/template/iso'
 
@@ -871,12 +1702,9 @@ rm -rf "$WORK_DIR"
 echo "SUCCESS: $ISO_PATH"
 '''
 
-            stdin, stdout, stderr = ssh.exec_command(create_iso_script, timeout=60)
-            exit_code = stdout.channel.recv_exit_status()
-            output = stdout.read().decode()
-            errors = stderr.read().decode()
-
-            ssh.close()
+            with ssh_pool.session(self.host, 'root', self.password, timeout=30) as ssh:
+                exit_code, output, errors = run_remote_script(ssh, create_iso_script, timeout=60)
+            self.invalidate_cache('get_storage_content', node, storage)
 
             if exit_code == 0 and 'SUCCESS:' in output:
                 return {'success': True, 'answer_iso': f'{storage}:iso/{iso_name}'}
@@ -897,549 +1725,431 @@ echo "SUCCESS: $ISO_PATH"
         """
         # Auto-detect UEFI requirement if not specified
         if use_uefi is None:
-            use_uefi = windows_type in ['windows-11', 'windows-server-2025']
-
-        # Determine Windows image index based on type
-        # Using INDEX is more reliable than NAME since exact names vary by ISO
-        # For consumer multi-edition ISOs: Pro is typically index 5 or 6
-        # For Server ISOs: Standard Desktop Experience is typically index 2
-        image_indices = {
-            'windows-10': '5',        # Windows 10 Pro (typical position)
-            'windows-11': '5',        # Windows 11 Pro (typical position)
-            'windows-server-2022': '2',  # Standard (Desktop Experience)
-            'windows-server-2025': '2',  # Standard (Desktop Experience)
+            use_uefi = windows_type in WINDOWS_UEFI_TYPES
+        return _render_windows_autounattend_xml(windows_type, username, password, static_ip,
+                                                gateway, dns, include_virtio_drivers, use_uefi)
+
+    def _get_windows_runner_setup_script(self, gitlab_url, runner_token):
+        """Generate Windows batch script to install GitLab Runner after Windows setup."""
+        return _render_windows_runner_setup_script(gitlab_url, runner_token)
+
+    # =========================================================================
+    # Container (LXC) Management
+    # =========================================================================
+
+    def create_container(self, node, vmid, hostname, ostemplate, storage, rootfs_size,
+                         cores=2, memory=4096, bridge='vmbr0', ip='dhcp',
+                         gateway=None, ssh_keys=None, password=None, start=False,
+                         privileged=False, features=None):
+        """Create an LXC container."""
+        params = {
+            'vmid': vmid,
+            'hostname': hostname,
+            'ostemplate': ostemplate,
+            'storage': storage,
+            'rootfs': f'{storage}:{rootfs_size}',
+            'cores': cores,
+            'memory': memory,
+            'unprivileged': 0 if privileged else 1,
+            'onboot': 1,
+            'start': 1 if start else 0,
         }
-        image_index = image_indices.get(windows_type, '1')
-
-        # VirtIO driver paths for Windows Setup to find drivers on the VirtIO ISO (E:)
-        # These allow Windows to detect the VirtIO SCSI disk during installation
-        virtio_driver_paths = ''
-        if include_virtio_drivers:
-            # Map Windows type to VirtIO driver folder names
-            virtio_folder_map = {
-                'windows-10': 'w10',
-                'windows-11': 'w11',
-                'windows-server-2022': '2k22',
-                'windows-server-2025': '2k25',
-            }
-            virtio_folder = virtio_folder_map.get(windows_type, 'w10')
 
-            virtio_driver_paths = f'''
-            <DriverPaths>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="1">
-                    <Path>E:\\vioscsi\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="2">
-                    <Path>E:\\viostor\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="3">
-                    <Path>E:\\NetKVM\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="4">
-                    <Path>E:\\Balloon\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="5">
-                    <Path>E:\\qxldod\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-                <PathAndCredentials wcm:action="add" wcm:keyValue="6">
-                    <Path>E:\\vioserial\\{virtio_folder}\\amd64</Path>
-                </PathAndCredentials>
-            </DriverPaths>'''
+        # Add features for Docker support (nesting, etc.)
+        if features:
+            params['features'] = features
 
         # Network configuration
-        if static_ip:
-            ip_parts = static_ip.split('/')[0] if '/' in static_ip else static_ip
-            prefix = static_ip.split('/')[1] if '/' in static_ip else '24'
-            network_config = f'''
-                    <component name="Microsoft-Windows-TCPIP" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-                        <Interfaces>
-                            <Interface wcm:action="add">
-                                <Identifier>Ethernet</Identifier>
-                                <Ipv4Settings>
-                                    <DhcpEnabled>false</DhcpEnabled>
-                                </Ipv4Settings>
-                                <UnicastIpAddresses>
-                                    <IpAddress wcm:action="add" wcm:keyValue="1">{ip_parts}/{prefix}</IpAddress>
-                                </UnicastIpAddresses>
-                                <Routes>
-                                    <Route wcm:action="add">
-                                        <Identifier>1</Identifier>
-                                        <NextHopAddress>{gateway or '192.168.1.1'}</NextHopAddress>
-                                        <Prefix>0.0.0.0/0</Prefix>
-                                    </Route>
-                                </Routes>
-                            </Interface>
-                        </Interfaces>
-                    </component>
-                    <component name="Microsoft-Windows-DNS-Client" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-                        <Interfaces>
-                            <Interface wcm:action="add">
-                                <Identifier>Ethernet</Identifier>
-                                <DNSServerSearchOrder>
-                                    <IpAddress wcm:action="add" wcm:keyValue="1">{dns}</IpAddress>
-                                </DNSServerSearchOrder>
-                            </Interface>
-                        </Interfaces>
-                    </component>'''
+        if ip == 'dhcp':
+            params['net0'] = f'name=eth0,bridge={bridge},ip=dhcp'
         else:
-            network_config = ''
+            cidr = ip if '/' in ip else f'{ip}/24'
+            net_config = f'name=eth0,bridge={bridge},ip={cidr}'
+            if gateway:
+                net_config += f',gw={gateway}'
+            params['net0'] = net_config
 
-        # VirtIO guest tools installation command (runs after first logon)
-        virtio_install_cmd = ''
-        if include_virtio_drivers:
-            virtio_install_cmd = '''
-                <SynchronousCommand wcm:action="add">
-                    <Order>3</Order>
-                    <CommandLine>cmd /c if exist E:\\virtio-win-guest-tools.exe E:\\virtio-win-guest-tools.exe /S</CommandLine>
-                    <Description>Install VirtIO Guest Tools (includes QEMU Guest Agent)</Description>
-                </SynchronousCommand>
-                <SynchronousCommand wcm:action="add">
-                    <Order>4</Order>
-                    <CommandLine>cmd /c if exist E:\\guest-agent\\qemu-ga-x86_64.msi msiexec /i E:\\guest-agent\\qemu-ga-x86_64.msi /qn</CommandLine>
-                    <Description>Install QEMU Guest Agent (fallback)</Description>
-                </SynchronousCommand>'''
+        # SSH keys (plus the deployer key, so provisioning can authenticate by key)
+        deployer_key = get_deployer_key()
+        if deployer_key:
+            ssh_keys = f'{ssh_keys}\n{deployer_key[1]}' if ssh_keys else deployer_key[1]
+        if ssh_keys:
+            params['ssh-public-keys'] = ssh_keys
 
-        # Driver paths component for windowsPE (only if VirtIO enabled)
-        pnp_component = ''
-        if include_virtio_drivers and virtio_driver_paths:
-            pnp_component = f'''
-        <component name="Microsoft-Windows-PnpCustomizationsWinPE" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS" xmlns:wcm="http://schemas.microsoft.com/WMIConfig/2002/State">{virtio_driver_paths}
-        </component>'''
+        # Root password
+        if password:
+            params['password'] = password
 
-        # Build partition configuration based on UEFI vs BIOS
-        if use_uefi:
-            create_partitions = '''
-                        <CreatePartition wcm:action="add">
-                            <Order>1</Order>
-                            <Type>EFI</Type>
-                            <Size>512</Size>
-                        </CreatePartition>
-                        <CreatePartition wcm:action="add">
-                            <Order>2</Order>
-                            <Type>MSR</Type>
-                            <Size>128</Size>
-                        </CreatePartition>
-                        <CreatePartition wcm:action="add">
-                            <Order>3</Order>
-                            <Type>Primary</Type>
-                            <Extend>true</Extend>
-                        </CreatePartition>'''
-            modify_partitions = '''
-                        <ModifyPartition wcm:action="add">
-                            <Order>1</Order>
-                            <PartitionID>1</PartitionID>
-                            <Format>FAT32</Format>
-                            <Label>System</Label>
-                        </ModifyPartition>
-                        <ModifyPartition wcm:action="add">
-                            <Order>2</Order>
-                            <PartitionID>2</PartitionID>
-                        </ModifyPartition>
-                        <ModifyPartition wcm:action="add">
-                            <Order>3</Order>
-                            <PartitionID>3</PartitionID>
-                            <Format>NTFS</Format>
-                            <Label>Windows</Label>
-                            <Letter>C</Letter>
-                        </ModifyPartition>'''
-            install_partition = '3'
-        else:
-            create_partitions = '''
-                        <CreatePartition wcm:action="add">
-                            <Order>1</Order>
-                            <Type>Primary</Type>
-                            <Extend>true</Extend>
-                        </CreatePartition>'''
-            modify_partitions = '''
-                        <ModifyPartition wcm:action="add">
-                            <Order>1</Order>
-                            <PartitionID>1</PartitionID>
-                            <Format>NTFS</Format>
-                            <Label>Windows</Label>
-                            <Letter>C</Letter>
-                            <Active>true</Active>
-                        </ModifyPartition>'''
-            install_partition = '1'
+        task = self._node(node).lxc.create(**params)
+        result = self.wait_for_task(node, task)
+        if result['success']:
+            self._node_changed(node)
 
-        return f'''<?xml version="1.0" encoding="utf-8"?>
-<unattend xmlns="urn:schemas-microsoft-com:unattend" xmlns:wcm="http://schemas.microsoft.com/WMIConfig/2002/State">
-    <settings pass="windowsPE">
-        <component name="Microsoft-Windows-International-Core-WinPE" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-            <SetupUILanguage>
-                <UILanguage>en-US</UILanguage>
-            </SetupUILanguage>
-            <InputLocale>en-US</InputLocale>
-            <SystemLocale>en-US</SystemLocale>
-            <UILanguage>en-US</UILanguage>
-            <UserLocale>en-US</UserLocale>
-        </component>{pnp_component}
-        <component name="Microsoft-Windows-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-            <DiskConfiguration>
-                <Disk wcm:action="add">
-                    <CreatePartitions>{create_partitions}
-                    </CreatePartitions>
-                    <ModifyPartitions>{modify_partitions}
-                    </ModifyPartitions>
-                    <DiskID>0</DiskID>
-                    <WillWipeDisk>true</WillWipeDisk>
-                </Disk>
-            </DiskConfiguration>
-            <ImageInstall>
-                <OSImage>
-                    <InstallTo>
-                        <DiskID>0</DiskID>
-                        <PartitionID>{install_partition}</PartitionID>
-                    </InstallTo>
-                    <InstallFrom>
-                        <MetaData wcm:action="add">
-                            <Key>/IMAGE/INDEX</Key>
-                            <Value>{image_index}</Value>
-                        </MetaData>
-                    </InstallFrom>
-                </OSImage>
-            </ImageInstall>
-            <UserData>
-                <ProductKey>
-                    <WillShowUI>OnError</WillShowUI>
-                </ProductKey>
-                <AcceptEula>true</AcceptEula>
-            </UserData>
-        </component>
-    </settings>
-    <settings pass="specialize">
-        <component name="Microsoft-Windows-Shell-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-            <ComputerName>*</ComputerName>
-            <TimeZone>UTC</TimeZone>
-        </component>{network_config}
-    </settings>
-    <settings pass="oobeSystem">
-        <component name="Microsoft-Windows-Shell-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
-            <OOBE>
-                <HideEULAPage>true</HideEULAPage>
-                <HideLocalAccountScreen>true</HideLocalAccountScreen>
-                <HideOEMRegistrationScreen>true</HideOEMRegistrationScreen>
-                <HideOnlineAccountScreens>true</HideOnlineAccountScreens>
-                <HideWirelessSetupInOOBE>true</HideWirelessSetupInOOBE>
-                <ProtectYourPC>3</ProtectYourPC>
-                <SkipMachineOOBE>true</SkipMachineOOBE>
-                <SkipUserOOBE>true</SkipUserOOBE>
-            </OOBE>
-            <UserAccounts>
-                <LocalAccounts>
-                    <LocalAccount wcm:action="add">
-                        <Password>
-                            <Value>{password}</Value>
-                            <PlainText>true</PlainText>
-                        </Password>
-                        <DisplayName>{username}</DisplayName>
-                        <Group>Administrators</Group>
-                        <Name>{username}</Name>
-                    </LocalAccount>
-                </LocalAccounts>
-            </UserAccounts>
-            <AutoLogon>
-                <Password>
-                    <Value>{password}</Value>
-                    <PlainText>true</PlainText>
-                </Password>
-                <Enabled>true</Enabled>
-                <Username>{username}</Username>
-            </AutoLogon>
-            <FirstLogonCommands>
-                <SynchronousCommand wcm:action="add">
-                    <Order>1</Order>
-                    <CommandLine>powershell -ExecutionPolicy Bypass -Command "Enable-PSRemoting -Force; Set-Item WSMan:\\localhost\\Client\\TrustedHosts -Value '*' -Force"</CommandLine>
-                    <Description>Enable PowerShell Remoting</Description>
-                </SynchronousCommand>
-                <SynchronousCommand wcm:action="add">
-                    <Order>2</Order>
-                    <CommandLine>cmd /c if exist C:\\Windows\\Setup\\Scripts\\SetupComplete.cmd call C:\\Windows\\Setup\\Scripts\\SetupComplete.cmd</CommandLine>
-                    <Description>Run SetupComplete script</Description>
-                </SynchronousCommand>{virtio_install_cmd}
-            </FirstLogonCommands>
-        </component>
-    </settings>
-    <cpi:offlineImage cpi:source="" xmlns:cpi="urn:schemas-microsoft-com:cpi" />
-</unattend>'''
+        if result['success'] and start:
+            time.sleep(2)
+            self.start_container(node, vmid)
 
-    def _get_windows_runner_setup_script(self, gitlab_url, runner_token):
-        """Generate Windows batch script to install GitLab Runner after Windows setup."""
-        # Build the registration and service commands based on what info we have
-        if gitlab_url and runner_token:
-            # Full auto-registration with retry loop for GitLab availability
-            registration_cmds = f'''
-echo.
-echo Waiting for GitLab server to be available...
-echo This may take 10-15 minutes if GitLab is being installed...
-set GITLAB_URL={gitlab_url}
-set RETRY_COUNT=0
-set MAX_RETRIES=60
+        return result
 
-:waitloop
-set /a RETRY_COUNT+=1
-echo [%TIME%] Attempt %RETRY_COUNT% of %MAX_RETRIES%: Checking %GITLAB_URL%
-powershell -Command "try {{ $r = Invoke-WebRequest -Uri '%GITLAB_URL%' -TimeoutSec 10 -UseBasicParsing -ErrorAction Stop; exit 0 }} catch {{ exit 1 }}"
-if %errorlevel%==0 goto gitlab_ready
-if %RETRY_COUNT% geq %MAX_RETRIES% goto gitlab_timeout
-echo GitLab not ready yet, waiting 30 seconds...
-timeout /t 30 /nobreak >nul
-goto waitloop
+    def _node(self, node):
+        """Get the cached API resource for a node (nodes/{node})."""
+        handle = self._node_handles.get(node)
+        if handle is None:
+            handle = self._node_handles[node] = self.proxmox.nodes(node)
+        return handle
 
-:gitlab_timeout
-echo.
-echo WARNING: GitLab did not become available after 30 minutes.
-echo Runner binary is installed but not registered.
-echo To register later, run: gitlab-runner.exe register --url {gitlab_url}
-goto scriptend
+    def _lxc(self, node, vmid, *path):
+        """Get the cached API resource for a container (nodes/{node}/lxc/{vmid}[/path...]).
 
-:gitlab_ready
-echo.
-echo GitLab is available! Registering runner...
-cd C:\\GitLab-Runner
-gitlab-runner.exe register --non-interactive --url "{gitlab_url}" --registration-token "{runner_token}" --executor "shell" --description "windows-runner" --tag-list "windows,shell" --run-untagged="true" --locked="false"
-if %errorlevel%==0 (
-    echo Registration successful! Installing as service...
-    gitlab-runner.exe install
-    gitlab-runner.exe start
-    echo GitLab Runner installed and running!
-) else (
-    echo Registration failed. You may need to register manually.
-)
-goto scriptend
-'''
-        elif gitlab_url:
-            # Have URL but no token
-            registration_cmds = f'''
-echo.
-echo GitLab Runner binary installed.
-echo No registration token provided - manual registration required.
-echo.
-echo To register, open Admin Command Prompt and run:
-echo   cd C:\\GitLab-Runner
-echo   gitlab-runner.exe register --url {gitlab_url}
-echo   gitlab-runner.exe install
-echo   gitlab-runner.exe start
-goto scriptend
-'''
-        else:
-            # No URL, no token - just install binary
-            registration_cmds = '''
-echo.
-echo GitLab Runner binary installed.
-echo No GitLab URL provided - manual registration required.
-echo.
-echo To register, open Admin Command Prompt and run:
-echo   cd C:\\GitLab-Runner
-echo   gitlab-runner.exe register --url YOUR_GITLAB_URL
-echo   gitlab-runner.exe install
-echo   gitlab-runner.exe start
-goto scriptend
-'''
+        Extra path segments select a sub-resource that is cached as well, so
+        polling loops (status/current, interfaces) reuse one resource object.
+        """
+        key = (node, vmid, *path)
+        handle = self._lxc_handles.get(key)
+        if handle is None:
+            if path:
+                handle = self._lxc(node, vmid)
+                for segment in path:
+                    handle = getattr(handle, segment)
+            else:
+                handle = self._node(node).lxc(vmid)
+            self._lxc_handles[key] = handle
+        return handle
 
-        return f'''@echo off
-REM GitLab Runner Installation Script
-REM This runs automatically after Windows installation completes
+    def start_container(self, node, vmid):
+        """Start a container."""
+        try:
+            self._lxc(node, vmid).status.start.post()
+            self.invalidate_cache('get_container_status', node, vmid)
+            self.invalidate_cache('get_cluster_snapshot')
+            self._container_ips.pop((node, vmid), None)
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
 
-echo ============================================
-echo GitLab Runner Installation
-echo ============================================
+    def stop_container(self, node, vmid):
+        """Stop a container."""
+        try:
+            self._lxc(node, vmid).status.stop.post()
+            self.invalidate_cache('get_container_status', node, vmid)
+            self.invalidate_cache('get_cluster_snapshot')
+            self._container_ips.pop((node, vmid), None)
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
 
-REM Create runner directory
-mkdir C:\\GitLab-Runner 2>nul
-cd C:\\GitLab-Runner
+    @ttl_cached(5, allow_stale=True)
+    def get_container_status(self, node, vmid):
+        """Get container status."""
+        return self._lxc(node, vmid, 'status', 'current').get()
+
+    @ttl_cached(30, allow_stale=True)
+    def get_container_config(self, node, vmid):
+        """Get container configuration."""
+        return self._lxc(node, vmid).config.get()
+
+    def _config_ip(self, node, vmid):
+        """Return the static IP from the container config, or None for DHCP."""
+        return parse_static_ip(self.get_container_config(node, vmid).get('net0', ''))
+
+    def _interface_ip(self, node, vmid):
+        """Return the first non-loopback eth0 address reported by the container, or None."""
+        for iface in self._lxc(node, vmid, 'interfaces').get():
+            if iface.get('name') == 'eth0':
+                for addr in iface.get('inet', '').split():
+                    if addr and not addr.startswith('127.'):
+                        return addr.split('/')[0]
+        return None
 
-REM Download GitLab Runner with retry
-echo Downloading GitLab Runner...
-set DL_RETRY=0
-:downloadloop
-set /a DL_RETRY+=1
-echo Download attempt %DL_RETRY%...
-powershell -Command "try {{ [Net.ServicePointManager]::SecurityProtocol = [Net.SecurityProtocolType]::Tls12; Invoke-WebRequest -Uri 'https://gitlab-runner-downloads.s3.amazonaws.com/latest/binaries/gitlab-runner-windows-amd64.exe' -OutFile 'C:\\GitLab-Runner\\gitlab-runner.exe' -TimeoutSec 120 }} catch {{ Write-Host $_.Exception.Message; exit 1 }}"
-if exist C:\\GitLab-Runner\\gitlab-runner.exe goto download_ok
-if %DL_RETRY% geq 5 goto download_fail
-echo Download failed, retrying in 30 seconds...
-timeout /t 30 /nobreak >nul
-goto downloadloop
+    def get_container_ip(self, node, vmid, timeout=120, max_delay=30):
+        """Wait for and return container IP address (see wait_for_container_ips)."""
+        return self.wait_for_container_ips(node, [vmid], timeout, max_delay).get(vmid)
 
-:download_fail
-echo ERROR: Failed to download GitLab Runner after 5 attempts.
-goto scriptend
+    def wait_for_container_ips(self, node, vmids, timeout=120, max_delay=30):
+        """Wait for the IP addresses of several containers at once.
 
-:download_ok
-echo Download successful.
-{registration_cmds}
-:scriptend
-echo.
-echo ============================================
-echo Script completed at %TIME%
-echo ============================================'''
+        Addresses already resolved for a container are returned without any
+        API call (until it is started or stopped again), and static IPs come
+        straight from the container config. The rest are polled together with
+        exponential backoff (capped at max_delay seconds): with more than one
+        pending, a single cluster/resources call picks out the running ones,
+        and only those get an interfaces call. Returns {vmid: ip} for the
+        containers that got an address within timeout seconds.
+        """
+        ips = {}
+        pending = []
+        for vmid in vmids:
+            ip = self._container_ips.get((node, vmid))
+            if not ip:
+                try:
+                    ip = self._config_ip(node, vmid)
+                except Exception:
+                    ip = None
+            if ip:
+                ips[vmid] = self._container_ips[(node, vmid)] = ip
+            else:
+                pending.append(vmid)
 
-    # =========================================================================
-    # Container (LXC) Management
-    # =========================================================================
-
-    def create_container(self, node, vmid, hostname, ostemplate, storage, rootfs_size,
-                         cores=2, memory=4096, bridge='vmbr0', ip='dhcp',
-                         gateway=None, ssh_keys=None, password=None, start=False,
-                         privileged=False, features=None):
-        """Create an LXC container."""
-        params = {
-            'vmid': vmid,
-            'hostname': hostname,
-            'ostemplate': ostemplate,
-            'storage': storage,
-            'rootfs': f'{storage}:{rootfs_size}',
-            'cores': cores,
-            'memory': memory,
-            'unprivileged': 0 if privileged else 1,
-            'onboot': 1,
-            'start': 1 if start else 0,
-        }
-
-        # Add features for Docker support (nesting, etc.)
-        if features:
-            params['features'] = features
-
-        # Network configuration
-        if ip == 'dhcp':
-            params['net0'] = f'name=eth0,bridge={bridge},ip=dhcp'
-        else:
-            cidr = ip if '/' in ip else f'{ip}/24'
-            net_config = f'name=eth0,bridge={bridge},ip={cidr}'
-            if gateway:
-                net_config += f',gw={gateway}'
-            params['net0'] = net_config
-
-        # SSH keys
-        if ssh_keys:
-            params['ssh-public-keys'] = ssh_keys
-
-        # Root password
-        if password:
-            params['password'] = password
-
-        task = self.proxmox.nodes(node).lxc.create(**params)
-        result = self.wait_for_task(node, task)
-
-        if result['success'] and start:
-            time.sleep(2)
-            self.start_container(node, vmid)
-
-        return result
-
-    def start_container(self, node, vmid):
-        """Start a container."""
-        try:
-            self.proxmox.nodes(node).lxc(vmid).status.start.post()
-            return {'success': True}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-
-    def stop_container(self, node, vmid):
-        """Stop a container."""
-        try:
-            self.proxmox.nodes(node).lxc(vmid).status.stop.post()
-            return {'success': True}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-
-    def get_container_status(self, node, vmid):
-        """Get container status."""
-        return self.proxmox.nodes(node).lxc(vmid).status.current.get()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while pending:
+            candidates = pending
+            if len(pending) > 1:
+                try:
+                    self.invalidate_cache('get_cluster_snapshot')
+                    snapshot = self.get_cluster_snapshot()
+                    candidates = [vmid for vmid in pending
+                                  if snapshot.get(vmid, {}).get('status') == 'running']
+                except Exception:
+                    pass
+
+            if candidates:
+                with ThreadPoolExecutor(max_workers=min(len(candidates), 8)) as executor:
+                    futures = {executor.submit(self._interface_ip, node, vmid): vmid for vmid in candidates}
+                    for future in as_completed(futures):
+                        try:
+                            ip = future.result()
+                        except Exception:
+                            continue
+                        if ip:
+                            vmid = futures[future]
+                            ips[vmid] = self._container_ips[(node, vmid)] = ip
+                pending = [vmid for vmid in pending if vmid not in ips]
+                if not pending:
+                    break
 
-    def get_container_ip(self, node, vmid, timeout=120):
-        """Wait for and return container IP address."""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                config = self.proxmox.nodes(node).lxc(vmid).config.get()
-                net0 = config.get('net0', '')
-                if 'ip=' in net0:
-                    ip_part = [p for p in net0.split(',') if p.startswith('ip=')]
-                    if ip_part and ip_part[0] != 'ip=dhcp':
-                        return ip_part[0].replace('ip=', '').split('/')[0]
-
-                # Try to get IP from interfaces
-                interfaces = self.proxmox.nodes(node).lxc(vmid).interfaces.get()
-                for iface in interfaces:
-                    if iface.get('name') == 'eth0':
-                        for addr in iface.get('inet', '').split():
-                            if addr and not addr.startswith('127.'):
-                                return addr.split('/')[0]
-            except Exception:
-                pass
-            time.sleep(3)
-        return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(backoff_delay(attempt, cap=max_delay), remaining))
+            attempt += 1
+        return ips
 
-    def provision_container(self, node, vmid, script, timeout=600):
+    def provision_container(self, node, vmid, script, timeout=600, on_output=None, ip_timeout=20):
         """Execute a provisioning script inside a container.
 
         Tries two methods:
         1. Direct SSH to container IP (faster if SSH is running)
         2. Fallback: pct exec via SSH to Proxmox host (more reliable for fresh containers)
-        """
-        paramiko = _get_paramiko()
 
+        pct exec doesn't need the container's network, so the IP is only waited
+        for ip_timeout seconds; a container without one by then goes straight
+        to pct exec.
+
+        SSH sessions come from the shared ssh_pool, so consecutive scripts for the
+        same container (or the same Proxmox host) reuse one connection.
+        on_output(stream, data) receives the script's output as it arrives;
+        the returned 'output' only holds its tail (see exec_command_streaming).
+        """
         print(f"[PROVISION] Starting provisioning for container {vmid} on node {node}")
 
         # Method 1: Try direct SSH to container
-        ip = self.get_container_ip(node, vmid)
+        ip = self.get_container_ip(node, vmid, timeout=ip_timeout)
         print(f"[PROVISION] Container IP: {ip}")
 
         if ip:
             print(f"[PROVISION] Attempting direct SSH to {ip}...")
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            start_time = time.time()
+            ssh = None
+            deadline = time.monotonic() + 30
             connected = False
             last_error = None
+            attempt = 0
             # Try for 30 seconds before falling back (reduced from 60 - fresh containers won't have SSH)
-            while time.time() - start_time < 30:
+            # Short per-attempt timeouts so one hung connect can't eat the whole window
+            # Deployer key first; the password covers containers created without it
+            deployer_key = get_deployer_key()
+            while True:
+                # Cheap TCP probe first - no SSH handshake until port 22 is open
+                try:
+                    socket.create_connection((ip, 22), timeout=1).close()
+                except OSError:
+                    last_error = f'Port 22 on {ip} not reachable'
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    time.sleep(min(0.5, remaining))
+                    continue
+
                 try:
-                    ssh.connect(ip, username='root', password='root1', timeout=10)
+                    ssh = ssh_pool.acquire(ip, 'root', 'root1', timeout=5,
+                                           banner_timeout=5, auth_timeout=5,
+                                           pkey=deployer_key[0] if deployer_key else None,
+                                           allow_agent=False, look_for_keys=False)
                     connected = True
                     print(f"[PROVISION] Direct SSH connected!")
                     break
+                except socket.timeout:
+                    last_error = f'Connection to {ip}:22 timed out'
                 except Exception as e:
                     last_error = str(e)
-                    time.sleep(5)
+                    if isinstance(e, _get_paramiko().AuthenticationException):
+                        # Credentials won't start working on retry - go to pct exec now
+                        print(f"[PROVISION] SSH authentication to {ip} failed, not retrying")
+                        break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # sshd is up but still settling (banner/kex errors) - retry soon
+                time.sleep(min(backoff_delay(attempt, base=0.5, cap=8, jitter=0.25), remaining))
+                attempt += 1
 
             if connected:
                 try:
                     print(f"[PROVISION] Executing script via direct SSH...")
-                    script_b64 = base64.b64encode(script.encode()).decode()
-                    exec_cmd = f'echo "{script_b64}" | base64 -d | bash -s'
-
-                    stdin, stdout, stderr = ssh.exec_command(exec_cmd, timeout=timeout)
-                    exit_code = stdout.channel.recv_exit_status()
-                    output = stdout.read().decode()
-                    errors = stderr.read().decode()
-
-                    ssh.close()
+                    exit_code, output, errors = run_remote_script(ssh, script, timeout=timeout, on_output=on_output)
 
                     if exit_code == 0:
                         print(f"[PROVISION] Direct SSH provisioning succeeded")
                         return {'success': True, 'output': output, 'method': 'direct_ssh'}
                     else:
                         print(f"[PROVISION] Direct SSH script failed with exit code {exit_code}")
-                        return {'success': False, 'error': errors or output, 'exit_code': exit_code}
+                        return {'success': False, 'error': errors or output, 'output': output, 'exit_code': exit_code}
                 except Exception as e:
-                    try:
-                        ssh.close()
-                    except Exception:
-                        pass
                     last_error = str(e)
                     print(f"[PROVISION] Direct SSH exception: {last_error}")
+                finally:
+                    ssh_pool.release(ip, 'root', ssh)
 
             print(f"[PROVISION] Direct SSH failed ({last_error}), trying pct exec via Proxmox host...")
         else:
             print(f"[PROVISION] No container IP found, going straight to pct exec...")
 
         # Method 2: Fallback to pct exec via SSH to Proxmox host
-        return self._provision_via_pct_exec(node, vmid, script, timeout)
+        return self._provision_via_pct_exec(node, vmid, script, timeout, on_output)
+
+    def wait_for_gitlab_reconfigure(self, node, vmid, timeout=1800, max_delay=30):
+        """Wait for a detached `gitlab-ctl reconfigure` (see get_gitlab_install_script).
+
+        Polls `systemctl is-active` on the reconfigure unit - one short command
+        on the pooled SSH connection per poll - with exponential backoff.
+        """
+        command = f'systemctl is-active {GITLAB_RECONFIGURE_UNIT}'
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        state = None
+        while True:
+            result = self.provision_container(node, vmid, command, timeout=30)
+            lines = result.get('output', '').strip().splitlines()
+            state = lines[-1] if lines else None
+            if state == 'active':
+                return {'success': True}
+            if state == 'failed':
+                return {'success': False, 'error': 'gitlab-ctl reconfigure failed'}
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return {'success': False, 'error': f'gitlab-ctl reconfigure still {state or "unknown"} after {timeout}s'}
+            time.sleep(min(backoff_delay(attempt, base=5, cap=max_delay), remaining))
+            attempt += 1
+
+    def provision_container_batch(self, node, vmid, scripts, timeout=600, stop_on_error=True,
+                                  on_output=None):
+        """Execute several provisioning scripts inside a container in one session.
+
+        The scripts are wrapped into a single compound script, so the whole batch
+        costs one provision_container() call (one connection, one IP lookup).
+        Each step prints a __BF_DONE_<i>__:<rc> marker used to report per-step
+        exit codes. With stop_on_error=False every step runs regardless of
+        earlier failures.
+
+        on_output is passed through to provision_container().
+
+        Returns the provision_container() result plus 'results', a list of
+        {'index', 'exit_code'} for each step that ran.
+        """
+        parts = ['#!/bin/bash']
+        for i, script in enumerate(scripts):
+            parts.append(f'''
+cat > /tmp/bf_step_{i}.sh << 'BF_STEP_{i}_EOF'
+{script}
+BF_STEP_{i}_EOF
+bash /tmp/bf_step_{i}.sh
+rc=$?
+rm -f /tmp/bf_step_{i}.sh
+echo "__BF_DONE_{i}__:$rc"''')
+            if stop_on_error:
+                parts.append('[ "$rc" -eq 0 ] || exit "$rc"')
+        if not stop_on_error:
+            # Overall exit code reflects the last step
+            parts.append('exit "$rc"')
+
+        # Markers are collected from the live stream - the returned output is
+        # only a tail and may no longer contain the early ones
+        exit_codes = {}
+        pending = [b'']
+
+        def collect(stream, data):
+            if on_output:
+                on_output(stream, data)
+            if stream != 'stdout':
+                return
+            buffer = pending[0] + data
+            cut = buffer.rfind(b'\n')
+            if cut < 0:
+                pending[0] = buffer[-256:]
+                return
+            for index, rc in BATCH_STEP_MARKER.findall(buffer[:cut]):
+                exit_codes[int(index)] = int(rc)
+            pending[0] = buffer[cut:]
+
+        result = self.provision_container(node, vmid, '\n'.join(parts) + '\n', timeout, on_output=collect)
+        for index, rc in BATCH_STEP_MARKER.findall(pending[0]):
+            exit_codes[int(index)] = int(rc)
+        result['results'] = [
+            {'index': index, 'exit_code': exit_codes[index]}
+            for index in sorted(exit_codes)
+        ]
+        return result
+
+    def provision_many(self, jobs, max_concurrency=8, log_file=None):
+        """Provision several containers concurrently.
+
+        jobs: list of dicts with 'node', 'vmid' and 'scripts' (plus optional
+        'timeout' and 'stop_on_error'), each run via provision_container_batch().
+        At most max_concurrency jobs run at once - the default stays below
+        sshd's default MaxStartups of 10 for the shared Proxmox host.
+        If log_file is given, every job's output is appended to it as it
+        arrives, each line tagged with the job's VMID.
+        Returns one result dict per job, in order.
+        """
+        log = open(log_file, 'ab') if log_file else None
+        log_lock = threading.Lock()
+
+        def run(job):
+            sink = _LogLines(log, log_lock, f"[{job['vmid']}] ".encode()) if log else None
+            try:
+                return self.provision_container_batch(
+                    job['node'], job['vmid'], job['scripts'],
+                    timeout=job.get('timeout', 600),
+                    stop_on_error=job.get('stop_on_error', True),
+                    on_output=sink
+                )
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
+            finally:
+                if sink:
+                    sink.close()
+
+        # Resolve all container IPs in one batched wait; provision_container()
+        # then finds them in the per-container IP memo
+        by_node = {}
+        for job in jobs:
+            by_node.setdefault(job['node'], []).append(job['vmid'])
+        for node, vmids in by_node.items():
+            try:
+                self.wait_for_container_ips(node, vmids)
+            except Exception:
+                pass
 
-    def _provision_via_pct_exec(self, node, vmid, script, timeout=600):
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                return list(executor.map(run, jobs))
+        finally:
+            if log:
+                log.close()
+
+    def _provision_via_pct_exec(self, node, vmid, script, timeout=600, on_output=None):
         """Execute provisioning script via pct exec (SSH to Proxmox host, then pct exec into container).
 
         Uses file-based approach to avoid command line length limits:
@@ -1447,20 +2157,16 @@ echo ============================================'''
         2. Push file into container using pct push
         3. Execute script inside container using pct exec
         """
-        paramiko = _get_paramiko()
-
         if not self.password:
             return {'success': False, 'error': 'No Proxmox password configured for pct exec fallback'}
 
-        print(f"[PCT_EXEC] Connecting to Proxmox host {self.host}...")
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
+        host = self._node_host(node)
+        print(f"[PCT_EXEC] Connecting to Proxmox host {host}...")
         try:
-            ssh.connect(self.host, username='root', password=self.password, timeout=30)
+            ssh = ssh_pool.acquire(host, 'root', self.password, timeout=30)
         except Exception as e:
             print(f"[PCT_EXEC] SSH connection failed: {str(e)}")
-            return {'success': False, 'error': f'Could not SSH to Proxmox host {self.host}: {str(e)}'}
+            return {'success': False, 'error': f'Could not SSH to Proxmox host {host}: {str(e)}'}
 
         try:
             # Test basic connectivity
@@ -1490,7 +2196,6 @@ echo ============================================'''
                     if exit_code != 0 or 'pct_exec_test_ok' not in test_output:
                         error_msg = f'pct exec test failed after starting container: exit={exit_code}, output={test_output}, error={test_error}'
                         print(f"[PCT_EXEC] {error_msg}")
-                        ssh.close()
                         return {'success': False, 'error': error_msg}
 
             print(f"[PCT_EXEC] pct exec test passed")
@@ -1517,25 +2222,18 @@ echo ============================================'''
                 push_error = stderr.read().decode()
                 print(f"[PCT_EXEC] pct push failed: {push_error}")
                 ssh.exec_command(f'rm -f {temp_script}')
-                ssh.close()
                 return {'success': False, 'error': f'Failed to push script to container: {push_error}'}
 
             # Execute script inside container
             print(f"[PCT_EXEC] Executing provisioning script inside container {vmid}...")
-            stdin, stdout, stderr = ssh.exec_command(
-                f'pct exec {vmid} -- bash {container_script}',
-                timeout=timeout
+            exit_code, output, errors = exec_command_streaming(
+                ssh, f'pct exec {vmid} -- bash {container_script}', timeout=timeout, on_output=on_output
             )
-            exit_code = stdout.channel.recv_exit_status()
-            output = stdout.read().decode()
-            errors = stderr.read().decode()
 
             # Cleanup temp files
             ssh.exec_command(f'rm -f {temp_script}')
             ssh.exec_command(f'pct exec {vmid} -- rm -f {container_script}')
 
-            ssh.close()
-
             if exit_code == 0:
                 print(f"[PCT_EXEC] Provisioning completed successfully")
                 return {'success': True, 'output': output, 'method': 'pct_exec'}
@@ -1543,15 +2241,13 @@ echo ============================================'''
                 print(f"[PCT_EXEC] Provisioning failed with exit code {exit_code}")
                 print(f"[PCT_EXEC] stdout: {output[:500]}")
                 print(f"[PCT_EXEC] stderr: {errors[:500]}")
-                return {'success': False, 'error': errors or output, 'exit_code': exit_code}
+                return {'success': False, 'error': errors or output, 'output': output, 'exit_code': exit_code}
 
         except Exception as e:
             print(f"[PCT_EXEC] Exception: {str(e)}")
-            try:
-                ssh.close()
-            except Exception:
-                pass
             return {'success': False, 'error': f'pct exec failed: {str(e)}'}
+        finally:
+            ssh_pool.release(host, 'root', ssh)
 
     # =========================================================================
     # VM (QEMU) Management
@@ -1606,48 +2302,19 @@ echo ============================================'''
         # 4. ISOs attached via USB storage in QEMU args (IDE/SATA not seen by UEFI)
         # 5. Ventura (13.x) is most reliable; Sequoia/Sonoma may have compatibility issues
         if is_macos:
-            osk = 'ourhardworkbythesewordsguardedpleasedontsteal(c)AppleComputerInc'
             # Use SATA for OS disk - VirtIO is not visible in macOS Recovery
             params['sata2'] = f'{storage}:{disk_size}'
             del params['scsi0']  # Remove VirtIO disk
-            params.update({
-                'bios': 'ovmf',
-                'machine': 'q35',
-                'vga': 'vmware',
-                'ostype': 'other',
-                'efidisk0': f'{storage}:1,efitype=4m',
-                # Note: ISOs should be attached via USB storage in args for UEFI boot
-                # The ISO params are set separately - this args handles the core macOS emulation
-                'args': ' '.join([
-                    f'-device isa-applesmc,osk={osk}',
-                    '-smbios type=2',
-                    '-device usb-kbd',
-                    '-device usb-tablet',
-                    '-global nec-usb-xhci.msi=off',
-                    '-cpu host,kvm=on,vendor=GenuineIntel,+kvm_pv_unhalt,+kvm_pv_eoi,+hypervisor,+invtsc'
-                ])
-            })
+            params.update(MACOS_VM_PARAMS)
+            params['efidisk0'] = f'{storage}:1,efitype=4m'
         # Windows-specific configuration
         elif is_windows:
-            # Windows 11 and Server 2025 REQUIRE UEFI + TPM 2.0
-            needs_uefi = windows_version in ['windows-11', 'windows-server-2025']
-
-            if needs_uefi:
-                # Windows 11/Server 2025: Must use UEFI
-                params.update({
-                    'bios': 'ovmf',
-                    'machine': 'q35',
-                    'efidisk0': f'{storage}:1',
-                    'ostype': 'win11',
-                    'tpmstate0': f'{storage}:1,version=v2.0',
-                })
+            if windows_version in WINDOWS_UEFI_TYPES:
+                params.update(WINDOWS_UEFI_VM_PARAMS)
+                params['efidisk0'] = f'{storage}:1'
+                params['tpmstate0'] = f'{storage}:1,version=v2.0'
             else:
-                # Windows 10/Server 2022: Use SeaBIOS (avoids UEFI boot issues)
-                params.update({
-                    'bios': 'seabios',
-                    'machine': 'pc',
-                    'ostype': 'win10',
-                })
+                params.update(WINDOWS_SEABIOS_VM_PARAMS)
         else:
             params['bios'] = bios
             params['machine'] = machine
@@ -1657,89 +2324,531 @@ echo ============================================'''
         for key, value in sorted(params.items()):
             print(f"[DEBUG]   {key}: {value}")
 
-        task = self.proxmox.nodes(node).qemu.create(**params)
-        return self.wait_for_task(node, task)
+        task = self._node(node).qemu.create(**params)
+        result = self.wait_for_task(node, task)
+        if result['success']:
+            self._node_changed(node)
+        return result
+
+    def _qemu(self, node, vmid, *path):
+        """Get the cached API resource for a VM (nodes/{node}/qemu/{vmid}[/path...]).
+
+        Extra path segments select a sub-resource that is cached as well, so
+        polling loops (status/current, interfaces) reuse one resource object.
+        """
+        key = (node, vmid, *path)
+        handle = self._qemu_handles.get(key)
+        if handle is None:
+            if path:
+                handle = self._qemu(node, vmid)
+                for segment in path:
+                    handle = getattr(handle, segment)
+            else:
+                handle = self._node(node).qemu(vmid)
+            self._qemu_handles[key] = handle
+        return handle
 
     def start_vm(self, node, vmid):
         """Start a VM."""
         try:
-            self.proxmox.nodes(node).qemu(vmid).status.start.post()
+            self._qemu(node, vmid).status.start.post()
+            self.invalidate_cache('get_vm_status', node, vmid)
+            self.invalidate_cache('get_cluster_snapshot')
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def stop_vm(self, node, vmid):
+        """Stop a VM."""
+        try:
+            self._qemu(node, vmid).status.stop.post()
+            self.invalidate_cache('get_vm_status', node, vmid)
+            self.invalidate_cache('get_cluster_snapshot')
+            return {'success': True}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    @ttl_cached(5, allow_stale=True)
+    def get_vm_status(self, node, vmid):
+        """Get VM status."""
+        return self._qemu(node, vmid, 'status', 'current').get()
+
+    def reconfigure_vm_boot(self, node, vmid, eject_cdroms=True):
+        """Reconfigure VM boot order after OS installation.
+
+        This changes the boot order to prioritize the hard disk and optionally
+        ejects CD-ROM media to prevent booting from installation media.
+
+        Args:
+            node: Proxmox node name
+            vmid: VM ID
+            eject_cdroms: If True, ejects all CD-ROM media (ide2, ide3, sata0)
+
+        Returns:
+            dict with success status
+        """
+        try:
+            config_updates = {
+                'boot': 'order=scsi0',  # Boot from hard disk only
+            }
+
+            if eject_cdroms:
+                # Eject CD-ROMs by setting them to empty (none)
+                # These are the CD-ROM positions used for Windows installation
+                config_updates['ide2'] = 'none,media=cdrom'
+                config_updates['ide3'] = 'none,media=cdrom'
+                config_updates['sata0'] = 'none,media=cdrom'
+
+            self._qemu(node, vmid).config.put(**config_updates)
+            return {'success': True, 'message': 'Boot configuration updated'}
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+
+    def delete_vm_cdrom(self, node, vmid, device):
+        """Delete a CD-ROM device from VM configuration.
+
+        Args:
+            node: Proxmox node name
+            vmid: VM ID
+            device: Device name (ide2, ide3, sata0)
+
+        Returns:
+            dict with success status
+        """
+        try:
+            self._qemu(node, vmid).config.put(delete=device)
             return {'success': True}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def stop_vm(self, node, vmid):
-        """Stop a VM."""
-        try:
-            self.proxmox.nodes(node).qemu(vmid).status.stop.post()
-            return {'success': True}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
 
-    def get_vm_status(self, node, vmid):
-        """Get VM status."""
-        return self.proxmox.nodes(node).qemu(vmid).status.current.get()
+# =============================================================================
+# Installation Scripts
+# =============================================================================
+# Script bodies are module-level str.format() templates built once at import;
+# literal braces in the scripts are doubled ({{ }}). User-supplied values that
+# land in shell commands are shlex.quote()d before substitution, and the
+# rendered scripts are memoized since a deployment renders the same ones
+# for every runner of a kind.
+
+# =============================================================================
+# Windows Unattended Installation (autounattend.xml, SetupComplete runner script)
+# =============================================================================
+
+# Windows image index to install from each ISO
+# Using INDEX is more reliable than NAME since exact names vary by ISO
+# For consumer multi-edition ISOs: Pro is typically index 5 or 6
+# For Server ISOs: Standard Desktop Experience is typically index 2
+WINDOWS_IMAGE_INDICES = MappingProxyType({
+    'windows-10': '5',        # Windows 10 Pro (typical position)
+    'windows-11': '5',        # Windows 11 Pro (typical position)
+    'windows-server-2022': '2',  # Standard (Desktop Experience)
+    'windows-server-2025': '2',  # Standard (Desktop Experience)
+})
+
+# VirtIO driver folder names on the VirtIO ISO per Windows type
+WINDOWS_VIRTIO_FOLDERS = MappingProxyType({
+    'windows-10': 'w10',
+    'windows-11': 'w11',
+    'windows-server-2022': '2k22',
+    'windows-server-2025': '2k25',
+})
+
+# VirtIO driver paths for Windows Setup to find drivers on the VirtIO ISO (E:)
+# These allow Windows to detect the VirtIO SCSI disk during installation
+AUTOUNATTEND_DRIVER_PATHS_TEMPLATE = '''
+            <DriverPaths>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="1">
+                    <Path>E:\\vioscsi\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="2">
+                    <Path>E:\\viostor\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="3">
+                    <Path>E:\\NetKVM\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="4">
+                    <Path>E:\\Balloon\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="5">
+                    <Path>E:\\qxldod\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+                <PathAndCredentials wcm:action="add" wcm:keyValue="6">
+                    <Path>E:\\vioserial\\{virtio_folder}\\amd64</Path>
+                </PathAndCredentials>
+            </DriverPaths>'''
+
+# Driver paths component for windowsPE (only if VirtIO enabled)
+AUTOUNATTEND_PNP_COMPONENT_TEMPLATE = '''
+        <component name="Microsoft-Windows-PnpCustomizationsWinPE" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS" xmlns:wcm="http://schemas.microsoft.com/WMIConfig/2002/State">{virtio_driver_paths}
+        </component>'''
+
+# Static network configuration (specialize pass)
+AUTOUNATTEND_STATIC_NETWORK_TEMPLATE = '''
+                    <component name="Microsoft-Windows-TCPIP" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+                        <Interfaces>
+                            <Interface wcm:action="add">
+                                <Identifier>Ethernet</Identifier>
+                                <Ipv4Settings>
+                                    <DhcpEnabled>false</DhcpEnabled>
+                                </Ipv4Settings>
+                                <UnicastIpAddresses>
+                                    <IpAddress wcm:action="add" wcm:keyValue="1">{ip_address}/{prefix}</IpAddress>
+                                </UnicastIpAddresses>
+                                <Routes>
+                                    <Route wcm:action="add">
+                                        <Identifier>1</Identifier>
+                                        <NextHopAddress>{gateway}</NextHopAddress>
+                                        <Prefix>0.0.0.0/0</Prefix>
+                                    </Route>
+                                </Routes>
+                            </Interface>
+                        </Interfaces>
+                    </component>
+                    <component name="Microsoft-Windows-DNS-Client" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+                        <Interfaces>
+                            <Interface wcm:action="add">
+                                <Identifier>Ethernet</Identifier>
+                                <DNSServerSearchOrder>
+                                    <IpAddress wcm:action="add" wcm:keyValue="1">{dns}</IpAddress>
+                                </DNSServerSearchOrder>
+                            </Interface>
+                        </Interfaces>
+                    </component>'''
+
+# VirtIO guest tools installation command (runs after first logon)
+AUTOUNATTEND_VIRTIO_INSTALL_COMMANDS = '''
+                <SynchronousCommand wcm:action="add">
+                    <Order>3</Order>
+                    <CommandLine>cmd /c if exist E:\\virtio-win-guest-tools.exe E:\\virtio-win-guest-tools.exe /S</CommandLine>
+                    <Description>Install VirtIO Guest Tools (includes QEMU Guest Agent)</Description>
+                </SynchronousCommand>
+                <SynchronousCommand wcm:action="add">
+                    <Order>4</Order>
+                    <CommandLine>cmd /c if exist E:\\guest-agent\\qemu-ga-x86_64.msi msiexec /i E:\\guest-agent\\qemu-ga-x86_64.msi /qn</CommandLine>
+                    <Description>Install QEMU Guest Agent (fallback)</Description>
+                </SynchronousCommand>'''
+
+# Partition layouts: GPT/UEFI and MBR/BIOS
+AUTOUNATTEND_UEFI_PARTITIONS = MappingProxyType({
+    'create_partitions': '''
+                        <CreatePartition wcm:action="add">
+                            <Order>1</Order>
+                            <Type>EFI</Type>
+                            <Size>512</Size>
+                        </CreatePartition>
+                        <CreatePartition wcm:action="add">
+                            <Order>2</Order>
+                            <Type>MSR</Type>
+                            <Size>128</Size>
+                        </CreatePartition>
+                        <CreatePartition wcm:action="add">
+                            <Order>3</Order>
+                            <Type>Primary</Type>
+                            <Extend>true</Extend>
+                        </CreatePartition>''',
+    'modify_partitions': '''
+                        <ModifyPartition wcm:action="add">
+                            <Order>1</Order>
+                            <PartitionID>1</PartitionID>
+                            <Format>FAT32</Format>
+                            <Label>System</Label>
+                        </ModifyPartition>
+                        <ModifyPartition wcm:action="add">
+                            <Order>2</Order>
+                            <PartitionID>2</PartitionID>
+                        </ModifyPartition>
+                        <ModifyPartition wcm:action="add">
+                            <Order>3</Order>
+                            <PartitionID>3</PartitionID>
+                            <Format>NTFS</Format>
+                            <Label>Windows</Label>
+                            <Letter>C</Letter>
+                        </ModifyPartition>''',
+    'install_partition': '3',
+})
+
+AUTOUNATTEND_BIOS_PARTITIONS = MappingProxyType({
+    'create_partitions': '''
+                        <CreatePartition wcm:action="add">
+                            <Order>1</Order>
+                            <Type>Primary</Type>
+                            <Extend>true</Extend>
+                        </CreatePartition>''',
+    'modify_partitions': '''
+                        <ModifyPartition wcm:action="add">
+                            <Order>1</Order>
+                            <PartitionID>1</PartitionID>
+                            <Format>NTFS</Format>
+                            <Label>Windows</Label>
+                            <Letter>C</Letter>
+                            <Active>true</Active>
+                        </ModifyPartition>''',
+    'install_partition': '1',
+})
+
+AUTOUNATTEND_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<unattend xmlns="urn:schemas-microsoft-com:unattend" xmlns:wcm="http://schemas.microsoft.com/WMIConfig/2002/State">
+    <settings pass="windowsPE">
+        <component name="Microsoft-Windows-International-Core-WinPE" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+            <SetupUILanguage>
+                <UILanguage>en-US</UILanguage>
+            </SetupUILanguage>
+            <InputLocale>en-US</InputLocale>
+            <SystemLocale>en-US</SystemLocale>
+            <UILanguage>en-US</UILanguage>
+            <UserLocale>en-US</UserLocale>
+        </component>{pnp_component}
+        <component name="Microsoft-Windows-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+            <DiskConfiguration>
+                <Disk wcm:action="add">
+                    <CreatePartitions>{create_partitions}
+                    </CreatePartitions>
+                    <ModifyPartitions>{modify_partitions}
+                    </ModifyPartitions>
+                    <DiskID>0</DiskID>
+                    <WillWipeDisk>true</WillWipeDisk>
+                </Disk>
+            </DiskConfiguration>
+            <ImageInstall>
+                <OSImage>
+                    <InstallTo>
+                        <DiskID>0</DiskID>
+                        <PartitionID>{install_partition}</PartitionID>
+                    </InstallTo>
+                    <InstallFrom>
+                        <MetaData wcm:action="add">
+                            <Key>/IMAGE/INDEX</Key>
+                            <Value>{image_index}</Value>
+                        </MetaData>
+                    </InstallFrom>
+                </OSImage>
+            </ImageInstall>
+            <UserData>
+                <ProductKey>
+                    <WillShowUI>OnError</WillShowUI>
+                </ProductKey>
+                <AcceptEula>true</AcceptEula>
+            </UserData>
+        </component>
+    </settings>
+    <settings pass="specialize">
+        <component name="Microsoft-Windows-Shell-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+            <ComputerName>*</ComputerName>
+            <TimeZone>UTC</TimeZone>
+        </component>{network_config}
+    </settings>
+    <settings pass="oobeSystem">
+        <component name="Microsoft-Windows-Shell-Setup" processorArchitecture="amd64" publicKeyToken="31bf3856ad364e35" language="neutral" versionScope="nonSxS">
+            <OOBE>
+                <HideEULAPage>true</HideEULAPage>
+                <HideLocalAccountScreen>true</HideLocalAccountScreen>
+                <HideOEMRegistrationScreen>true</HideOEMRegistrationScreen>
+                <HideOnlineAccountScreens>true</HideOnlineAccountScreens>
+                <HideWirelessSetupInOOBE>true</HideWirelessSetupInOOBE>
+                <ProtectYourPC>3</ProtectYourPC>
+                <SkipMachineOOBE>true</SkipMachineOOBE>
+                <SkipUserOOBE>true</SkipUserOOBE>
+            </OOBE>
+            <UserAccounts>
+                <LocalAccounts>
+                    <LocalAccount wcm:action="add">
+                        <Password>
+                            <Value>{password}</Value>
+                            <PlainText>true</PlainText>
+                        </Password>
+                        <DisplayName>{username}</DisplayName>
+                        <Group>Administrators</Group>
+                        <Name>{username}</Name>
+                    </LocalAccount>
+                </LocalAccounts>
+            </UserAccounts>
+            <AutoLogon>
+                <Password>
+                    <Value>{password}</Value>
+                    <PlainText>true</PlainText>
+                </Password>
+                <Enabled>true</Enabled>
+                <Username>{username}</Username>
+            </AutoLogon>
+            <FirstLogonCommands>
+                <SynchronousCommand wcm:action="add">
+                    <Order>1</Order>
+                    <CommandLine>powershell -ExecutionPolicy Bypass -Command "Enable-PSRemoting -Force; Set-Item WSMan:\\localhost\\Client\\TrustedHosts -Value '*' -Force"</CommandLine>
+                    <Description>Enable PowerShell Remoting</Description>
+                </SynchronousCommand>
+                <SynchronousCommand wcm:action="add">
+                    <Order>2</Order>
+                    <CommandLine>cmd /c if exist C:\\Windows\\Setup\\Scripts\\SetupComplete.cmd call C:\\Windows\\Setup\\Scripts\\SetupComplete.cmd</CommandLine>
+                    <Description>Run SetupComplete script</Description>
+                </SynchronousCommand>{virtio_install_cmd}
+            </FirstLogonCommands>
+        </component>
+    </settings>
+    <cpi:offlineImage cpi:source="" xmlns:cpi="urn:schemas-microsoft-com:cpi" />
+</unattend>'''
+
+
+@lru_cache(maxsize=32)
+def _render_windows_autounattend_xml(windows_type, username, password, static_ip, gateway, dns,
+                                     include_virtio_drivers, use_uefi):
+    """Render autounattend.xml (see ProxmoxClient._get_windows_autounattend_xml)."""
+    pnp_component = ''
+    virtio_install_cmd = ''
+    if include_virtio_drivers:
+        virtio_driver_paths = AUTOUNATTEND_DRIVER_PATHS_TEMPLATE.format(
+            virtio_folder=WINDOWS_VIRTIO_FOLDERS.get(windows_type, 'w10')
+        )
+        pnp_component = AUTOUNATTEND_PNP_COMPONENT_TEMPLATE.format(virtio_driver_paths=virtio_driver_paths)
+        virtio_install_cmd = AUTOUNATTEND_VIRTIO_INSTALL_COMMANDS
+
+    network_config = ''
+    if static_ip:
+        ip_address, _, prefix = static_ip.partition('/')
+        network_config = AUTOUNATTEND_STATIC_NETWORK_TEMPLATE.format(
+            ip_address=ip_address, prefix=prefix or '24', gateway=gateway or '192.168.1.1', dns=dns
+        )
+
+    partitions = AUTOUNATTEND_UEFI_PARTITIONS if use_uefi else AUTOUNATTEND_BIOS_PARTITIONS
+    return AUTOUNATTEND_TEMPLATE.format(
+        pnp_component=pnp_component,
+        network_config=network_config,
+        virtio_install_cmd=virtio_install_cmd,
+        image_index=WINDOWS_IMAGE_INDICES.get(windows_type, '1'),
+        username=username,
+        password=password,
+        **partitions
+    )
+
+
+# Full auto-registration with retry loop for GitLab availability
+WINDOWS_SETUP_RUNNER_REGISTER_TEMPLATE = '''
+echo.
+echo Waiting for GitLab server to be available...
+echo This may take 10-15 minutes if GitLab is being installed...
+set GITLAB_URL={gitlab_url}
+set RETRY_COUNT=0
+set MAX_RETRIES=60
 
-    def reconfigure_vm_boot(self, node, vmid, eject_cdroms=True):
-        """Reconfigure VM boot order after OS installation.
+:waitloop
+set /a RETRY_COUNT+=1
+echo [%TIME%] Attempt %RETRY_COUNT% of %MAX_RETRIES%: Checking %GITLAB_URL%
+powershell -Command "try {{ $r = Invoke-WebRequest -Uri '%GITLAB_URL%' -TimeoutSec 10 -UseBasicParsing -ErrorAction Stop; exit 0 }} catch {{ exit 1 }}"
+if %errorlevel%==0 goto gitlab_ready
+if %RETRY_COUNT% geq %MAX_RETRIES% goto gitlab_timeout
+echo GitLab not ready yet, waiting 30 seconds...
+timeout /t 30 /nobreak >nul
+goto waitloop
 
-        This changes the boot order to prioritize the hard disk and optionally
-        ejects CD-ROM media to prevent booting from installation media.
+:gitlab_timeout
+echo.
+echo WARNING: GitLab did not become available after 30 minutes.
+echo Runner binary is installed but not registered.
+echo To register later, run: gitlab-runner.exe register --url {gitlab_url}
+goto scriptend
 
-        Args:
-            node: Proxmox node name
-            vmid: VM ID
-            eject_cdroms: If True, ejects all CD-ROM media (ide2, ide3, sata0)
+:gitlab_ready
+echo.
+echo GitLab is available! Registering runner...
+cd C:\\GitLab-Runner
+gitlab-runner.exe register --non-interactive --url "{gitlab_url}" --registration-token "{runner_token}" --executor "shell" --description "windows-runner" --tag-list "windows,shell" --run-untagged="true" --locked="false"
+if %errorlevel%==0 (
+    echo Registration successful! Installing as service...
+    gitlab-runner.exe install
+    gitlab-runner.exe start
+    echo GitLab Runner installed and running!
+) else (
+    echo Registration failed. You may need to register manually.
+)
+goto scriptend
+'''
 
-        Returns:
-            dict with success status
-        """
-        try:
-            config_updates = {
-                'boot': 'order=scsi0',  # Boot from hard disk only
-            }
+# Have URL but no token
+WINDOWS_SETUP_RUNNER_URL_ONLY_TEMPLATE = '''
+echo.
+echo GitLab Runner binary installed.
+echo No registration token provided - manual registration required.
+echo.
+echo To register, open Admin Command Prompt and run:
+echo   cd C:\\GitLab-Runner
+echo   gitlab-runner.exe register --url {gitlab_url}
+echo   gitlab-runner.exe install
+echo   gitlab-runner.exe start
+goto scriptend
+'''
 
-            if eject_cdroms:
-                # Eject CD-ROMs by setting them to empty (none)
-                # These are the CD-ROM positions used for Windows installation
-                config_updates['ide2'] = 'none,media=cdrom'
-                config_updates['ide3'] = 'none,media=cdrom'
-                config_updates['sata0'] = 'none,media=cdrom'
+# No URL, no token - just install binary
+WINDOWS_SETUP_RUNNER_MANUAL = '''
+echo.
+echo GitLab Runner binary installed.
+echo No GitLab URL provided - manual registration required.
+echo.
+echo To register, open Admin Command Prompt and run:
+echo   cd C:\\GitLab-Runner
+echo   gitlab-runner.exe register --url YOUR_GITLAB_URL
+echo   gitlab-runner.exe install
+echo   gitlab-runner.exe start
+goto scriptend
+'''
 
-            self.proxmox.nodes(node).qemu(vmid).config.put(**config_updates)
-            return {'success': True, 'message': 'Boot configuration updated'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+WINDOWS_SETUP_RUNNER_TEMPLATE = '''@echo off
+REM GitLab Runner Installation Script
+REM This runs automatically after Windows installation completes
 
-    def delete_vm_cdrom(self, node, vmid, device):
-        """Delete a CD-ROM device from VM configuration.
+echo ============================================
+echo GitLab Runner Installation
+echo ============================================
 
-        Args:
-            node: Proxmox node name
-            vmid: VM ID
-            device: Device name (ide2, ide3, sata0)
+REM Create runner directory
+mkdir C:\\GitLab-Runner 2>nul
+cd C:\\GitLab-Runner
 
-        Returns:
-            dict with success status
-        """
-        try:
-            self.proxmox.nodes(node).qemu(vmid).config.put(delete=device)
-            return {'success': True}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+REM Download GitLab Runner with retry
+echo Downloading GitLab Runner...
+set DL_RETRY=0
+:downloadloop
+set /a DL_RETRY+=1
+echo Download attempt %DL_RETRY%...
+powershell -Command "try {{ [Net.ServicePointManager]::SecurityProtocol = [Net.SecurityProtocolType]::Tls12; Invoke-WebRequest -Uri 'https://gitlab-runner-downloads.s3.amazonaws.com/latest/binaries/gitlab-runner-windows-amd64.exe' -OutFile 'C:\\GitLab-Runner\\gitlab-runner.exe' -TimeoutSec 120 }} catch {{ Write-Host $_.Exception.Message; exit 1 }}"
+if exist C:\\GitLab-Runner\\gitlab-runner.exe goto download_ok
+if %DL_RETRY% geq 5 goto download_fail
+echo Download failed, retrying in 30 seconds...
+timeout /t 30 /nobreak >nul
+goto downloadloop
 
+:download_fail
+echo ERROR: Failed to download GitLab Runner after 5 attempts.
+goto scriptend
 
-# =============================================================================
-# Installation Scripts
-# =============================================================================
+:download_ok
+echo Download successful.
+{registration_cmds}
+:scriptend
+echo.
+echo ============================================
+echo Script completed at %TIME%
+echo ============================================'''
+
+
+@lru_cache(maxsize=32)
+def _render_windows_runner_setup_script(gitlab_url, runner_token):
+    """Render the SetupComplete runner script (see ProxmoxClient._get_windows_runner_setup_script)."""
+    # Build the registration and service commands based on what info we have
+    if gitlab_url and runner_token:
+        registration_cmds = WINDOWS_SETUP_RUNNER_REGISTER_TEMPLATE.format(
+            gitlab_url=gitlab_url, runner_token=runner_token
+        )
+    elif gitlab_url:
+        registration_cmds = WINDOWS_SETUP_RUNNER_URL_ONLY_TEMPLATE.format(gitlab_url=gitlab_url)
+    else:
+        registration_cmds = WINDOWS_SETUP_RUNNER_MANUAL
+    return WINDOWS_SETUP_RUNNER_TEMPLATE.format(registration_cmds=registration_cmds)
 
 # =============================================================================
 # Credential Injection Scripts
 # =============================================================================
 
-def get_linux_credential_script(username, password=None, ssh_public_key=None):
-    """Get a script to create a user account with password and/or SSH key on Linux."""
-    script = f'''#!/bin/bash
+LINUX_CREDENTIAL_TEMPLATE = '''#!/bin/bash
 set -e
 
 # Create user account
@@ -1749,35 +2858,50 @@ useradd -m -s /bin/bash {username} || true
 usermod -aG sudo {username} || usermod -aG wheel {username} || true
 '''
 
-    if password:
-        script += f'''
+LINUX_CREDENTIAL_PASSWORD_TEMPLATE = '''
 # Set password
-echo "{username}:{password}" | chpasswd
+echo {credentials} | chpasswd
 '''
 
-    if ssh_public_key:
-        script += f'''
+LINUX_CREDENTIAL_SSH_KEY_TEMPLATE = '''
 # Setup SSH key
 mkdir -p /home/{username}/.ssh
 chmod 700 /home/{username}/.ssh
-echo "{ssh_public_key}" >> /home/{username}/.ssh/authorized_keys
+echo {ssh_public_key} >> /home/{username}/.ssh/authorized_keys
 chmod 600 /home/{username}/.ssh/authorized_keys
 chown -R {username}:{username} /home/{username}/.ssh
 '''
 
-    script += f'''
+LINUX_CREDENTIAL_SUDO_TEMPLATE = '''
 # Allow passwordless sudo
 echo "{username} ALL=(ALL) NOPASSWD:ALL" > /etc/sudoers.d/{username}
 chmod 440 /etc/sudoers.d/{username}
 
 echo "User {username} created successfully"
 '''
-    return script
 
 
-def get_windows_credential_script(username, password):
-    """Get a PowerShell script to create a user account on Windows."""
-    return f'''# PowerShell script to create Windows user account
+@lru_cache(maxsize=128)
+def get_linux_credential_script(username, password=None, ssh_public_key=None):
+    """Get a script to create a user account with password and/or SSH key on Linux."""
+    parts = [LINUX_CREDENTIAL_TEMPLATE.format(username=username)]
+
+    if password:
+        parts.append(LINUX_CREDENTIAL_PASSWORD_TEMPLATE.format(
+            credentials=shlex.quote(f'{username}:{password}')
+        ))
+
+    if ssh_public_key:
+        parts.append(LINUX_CREDENTIAL_SSH_KEY_TEMPLATE.format(
+            username=username,
+            ssh_public_key=shlex.quote(ssh_public_key)
+        ))
+
+    parts.append(LINUX_CREDENTIAL_SUDO_TEMPLATE.format(username=username))
+    return ''.join(parts)
+
+
+WINDOWS_CREDENTIAL_TEMPLATE = '''# PowerShell script to create Windows user account
 $ErrorActionPreference = "Stop"
 
 $username = "{username}"
@@ -1812,19 +2936,27 @@ Write-Host "Windows user setup complete"
 '''
 
 
-def get_windows_ssh_key_script(username, ssh_public_key):
-    """Get a PowerShell script to add SSH key to Windows user."""
-    return f'''# PowerShell script to add SSH key to Windows user
+@lru_cache(maxsize=128)
+def get_windows_credential_script(username, password):
+    """Get a PowerShell script to create a user account on Windows."""
+    return WINDOWS_CREDENTIAL_TEMPLATE.format(username=username, password=password)
+
+
+WINDOWS_SSH_KEY_TEMPLATE = '''# PowerShell script to add SSH key to Windows user
 $ErrorActionPreference = "Stop"
 
 $username = "{username}"
 $sshKey = "{ssh_public_key}"
 
-# Get user profile path
-$userProfile = (Get-CimInstance Win32_UserProfile | Where-Object {{ $_.LocalPath -like "*$username*" }}).LocalPath
+# Get user profile path - the default location first, the CIM (WMI) query only
+# for profiles that live elsewhere
+$userProfile = "C:\\Users\\$username"
 
-if (-not $userProfile) {{
-    $userProfile = "C:\\Users\\$username"
+if (-not (Test-Path $userProfile)) {{
+    $cimProfile = (Get-CimInstance Win32_UserProfile | Where-Object {{ $_.LocalPath -like "*$username*" }}).LocalPath
+    if ($cimProfile) {{
+        $userProfile = $cimProfile
+    }}
 }}
 
 # Create .ssh directory
@@ -1850,80 +2982,97 @@ Write-Host "SSH key added for $username"
 '''
 
 
-def get_macos_credential_script(username, password=None, ssh_public_key=None):
-    """Get a script to create a user account on macOS."""
-    script = f'''#!/bin/bash
+@lru_cache(maxsize=128)
+def get_windows_ssh_key_script(username, ssh_public_key):
+    """Get a PowerShell script to add SSH key to Windows user."""
+    return WINDOWS_SSH_KEY_TEMPLATE.format(username=username, ssh_public_key=ssh_public_key)
+
+
+MACOS_CREDENTIAL_HEADER = '''#!/bin/bash
 set -e
+'''
 
+# Per-user section; several can follow one header (see get_macos_credentials_script)
+MACOS_CREDENTIAL_TEMPLATE = '''
 USERNAME="{username}"
 
 # Check if user exists
 if ! dscl . -read /Users/$USERNAME &>/dev/null; then
-    # Find next available UID
-    MAXID=$(dscl . -list /Users UniqueID | awk '{{print $2}}' | sort -ug | tail -1)
-    NEWID=$((MAXID+1))
-
-    # Create user
-    sudo dscl . -create /Users/$USERNAME
-    sudo dscl . -create /Users/$USERNAME UserShell /bin/zsh
-    sudo dscl . -create /Users/$USERNAME RealName "$USERNAME"
-    sudo dscl . -create /Users/$USERNAME UniqueID $NEWID
-    sudo dscl . -create /Users/$USERNAME PrimaryGroupID 20
-    sudo dscl . -create /Users/$USERNAME NFSHomeDirectory /Users/$USERNAME
+    # Create admin user (sysadminctl assigns the UID, shell, name and password in one call)
+    sudo sysadminctl -addUser "$USERNAME" -fullName "$USERNAME" -shell /bin/zsh -admin{password_args}
 
     # Create home directory
     sudo createhomedir -c -u $USERNAME
 
     echo "User $USERNAME created"
+else
+{existing_user_setup}
 fi
 '''
 
-    if password:
-        script += f'''
-# Set password
-sudo dscl . -passwd /Users/$USERNAME "{password}"
+MACOS_CREDENTIAL_PASSWORD_TEMPLATE = '''
+    # Set password
+    sudo dscl . -passwd /Users/$USERNAME {password}
 '''
 
-    script += '''
-# Add to admin group
-sudo dscl . -append /Groups/admin GroupMembership $USERNAME
+MACOS_CREDENTIAL_ADMIN = '''
+    # Add to admin group
+    sudo dscl . -append /Groups/admin GroupMembership $USERNAME
 '''
 
-    if ssh_public_key:
-        script += f'''
+MACOS_CREDENTIAL_SSH_KEY_TEMPLATE = '''
 # Setup SSH key
 sudo mkdir -p /Users/$USERNAME/.ssh
 sudo chmod 700 /Users/$USERNAME/.ssh
-echo "{ssh_public_key}" | sudo tee -a /Users/$USERNAME/.ssh/authorized_keys
+echo {ssh_public_key} | sudo tee -a /Users/$USERNAME/.ssh/authorized_keys
 sudo chmod 600 /Users/$USERNAME/.ssh/authorized_keys
 sudo chown -R $USERNAME:staff /Users/$USERNAME/.ssh
 '''
 
-    script += '''
+
+MACOS_CREDENTIAL_FOOTER = '''
 echo "macOS user setup complete"
 '''
-    return script
 
 
-def get_gitlab_install_script(domain, admin_password, letsencrypt_email=None, storage_config=None):
-    """Get GitLab installation script."""
-    storage_config = storage_config or {}
-    external_url = f'https://{domain}' if letsencrypt_email else f'http://{domain}'
+@lru_cache(maxsize=128)
+def _render_macos_credential_user(username, password=None, ssh_public_key=None):
+    """Render the MACOS_CREDENTIAL_TEMPLATE section for one account."""
+    password_args = ''
+    existing_user_setup = MACOS_CREDENTIAL_ADMIN
+    if password:
+        quoted_password = shlex.quote(password)
+        password_args = f' -password {quoted_password}'
+        existing_user_setup = MACOS_CREDENTIAL_PASSWORD_TEMPLATE.format(password=quoted_password) + existing_user_setup
 
-    # Add shared storage mounting
-    nfs_mount = get_nfs_mount_script_linux(
-        storage_config.get('nfs_share', ''),
-        storage_config.get('nfs_mount_path', '/mnt/shared')
-    )
-    samba_mount = get_samba_mount_script_linux(
-        storage_config.get('samba_share', ''),
-        storage_config.get('samba_mount_path', '/mnt/samba'),
-        storage_config.get('samba_username', ''),
-        storage_config.get('samba_password', ''),
-        storage_config.get('samba_domain', '')
-    )
+    parts = [MACOS_CREDENTIAL_TEMPLATE.format(
+        username=username,
+        password_args=password_args,
+        existing_user_setup=existing_user_setup
+    )]
+
+    if ssh_public_key:
+        parts.append(MACOS_CREDENTIAL_SSH_KEY_TEMPLATE.format(ssh_public_key=shlex.quote(ssh_public_key)))
+    return ''.join(parts)
+
+
+def get_macos_credential_script(username, password=None, ssh_public_key=None):
+    """Get a script to create a user account on macOS."""
+    return get_macos_credentials_script([(username, password, ssh_public_key)])
+
+
+def get_macos_credentials_script(users):
+    """Get one script creating several macOS accounts.
+
+    users is an iterable of (username, password, ssh_public_key) tuples
+    (password and key may be None). One script means one round trip to the
+    host, however many accounts it sets up.
+    """
+    sections = [_render_macos_credential_user(*user) for user in users]
+    return MACOS_CREDENTIAL_HEADER + ''.join(sections) + MACOS_CREDENTIAL_FOOTER
 
-    script = f'''#!/bin/bash
+
+GITLAB_INSTALL_TEMPLATE = '''#!/bin/bash
 set -e
 export DEBIAN_FRONTEND=noninteractive
 
@@ -1943,39 +3092,140 @@ cat >> /etc/gitlab/gitlab.rb << 'GITLAB_CONFIG'
 gitlab_rails['initial_root_password'] = "{admin_password}"
 '''
 
-    if letsencrypt_email:
-        script += f'''
+GITLAB_LETSENCRYPT_TEMPLATE = '''
 letsencrypt['enable'] = true
 letsencrypt['contact_emails'] = ['{letsencrypt_email}']
 '''
 
-    script += '''GITLAB_CONFIG
+# systemd unit that runs a detached `gitlab-ctl reconfigure`
+# (see ProxmoxClient.wait_for_gitlab_reconfigure)
+GITLAB_RECONFIGURE_UNIT = 'bf-gitlab-reconfigure'
+
+GITLAB_RECONFIGURE_TEMPLATE = '''GITLAB_CONFIG
 
 # Reconfigure GitLab
 gitlab-ctl reconfigure
 
 echo "GitLab installation complete!"
 '''
-    return script
 
+GITLAB_RECONFIGURE_DETACHED_TEMPLATE = '''GITLAB_CONFIG
+
+# Reconfigure GitLab in the background (5-10 minutes); the unit is "activating"
+# while it runs, then "active" on success or "failed"
+systemctl stop {unit} 2>/dev/null || true
+systemctl reset-failed {unit} 2>/dev/null || true
+systemd-run --no-block --unit={unit} --service-type=oneshot --remain-after-exit /usr/bin/gitlab-ctl reconfigure
+
+echo "GitLab installed, reconfigure running as {unit}"
+'''
+
+
+def get_gitlab_install_script(domain, admin_password, letsencrypt_email=None, storage_config=None,
+                              detach_reconfigure=False):
+    """Get GitLab installation script.
+
+    With detach_reconfigure=True the final `gitlab-ctl reconfigure` runs as the
+    GITLAB_RECONFIGURE_UNIT systemd unit and the script exits as soon as it
+    has started; use ProxmoxClient.wait_for_gitlab_reconfigure() to wait for it.
+    """
+    storage_config = storage_config or {}
+    external_url = f'https://{domain}' if letsencrypt_email else f'http://{domain}'
+
+    # Add shared storage mounting
+    nfs_mount = get_nfs_mount_script_linux(
+        storage_config.get('nfs_share', ''),
+        storage_config.get('nfs_mount_path', '/mnt/shared')
+    )
+    samba_mount = get_samba_mount_script_linux(
+        storage_config.get('samba_share', ''),
+        storage_config.get('samba_mount_path', '/mnt/samba'),
+        storage_config.get('samba_username', ''),
+        storage_config.get('samba_password', ''),
+        storage_config.get('samba_domain', '')
+    )
+
+    parts = [GITLAB_INSTALL_TEMPLATE.format(
+        nfs_mount=nfs_mount,
+        samba_mount=samba_mount,
+        external_url=external_url,
+        admin_password=admin_password
+    )]
+
+    if letsencrypt_email:
+        parts.append(GITLAB_LETSENCRYPT_TEMPLATE.format(letsencrypt_email=letsencrypt_email))
+
+    if detach_reconfigure:
+        parts.append(GITLAB_RECONFIGURE_DETACHED_TEMPLATE.format(unit=GITLAB_RECONFIGURE_UNIT))
+    else:
+        parts.append(GITLAB_RECONFIGURE_TEMPLATE)
+    return ''.join(parts)
+
+
+def get_runner_install_script(runner_type, gitlab_url, registration_token, storage_config=None):
+    """Get GitLab runner installation script based on runner type."""
+    factory = RUNNER_SCRIPT_FACTORIES.get(runner_type)
+    if factory is None:
+        return None
+    return factory(gitlab_url, registration_token, storage_config or {})
+
+
+LINUX_RUNNER_REGISTER_TEMPLATE = '''
+# Register runner with shell executor (works in containers without Docker)
+gitlab-runner register \\
+    --non-interactive \\
+    --url {gitlab_url} \\
+    --registration-token {registration_token} \\
+    --executor "shell" \\
+    --shell "bash" \\
+    --description "{distro}-runner" \\
+    --tag-list "linux,{distro},shell" \\
+    --run-untagged="true" \\
+    --locked="false"
+
+# Reinstall runner to run as root (needed for apt-get in CI jobs)
+gitlab-runner stop || true
+gitlab-runner uninstall || true
+gitlab-runner install --user root --working-directory /root
+gitlab-runner start
+'''
+
+LINUX_RUNNER_TEMPLATE = '''#!/bin/bash
+set -e
+export DEBIAN_FRONTEND=noninteractive
+
+# Fix DNS - use Google DNS as fallback
+if ! grep -q "8.8.8.8" /etc/resolv.conf 2>/dev/null; then
+    echo "nameserver 8.8.8.8" >> /etc/resolv.conf
+fi
 
-def get_runner_install_script(runner_type, gitlab_url, registration_token, storage_config=None):
-    """Get GitLab runner installation script based on runner type."""
-    storage_config = storage_config or {}
+{install_qemu_ga}
+# Install essential packages including sudo
+apt-get update
+apt-get install -y sudo curl git ca-certificates
 
-    if runner_type in ['debian', 'ubuntu', 'rocky', 'arch']:
-        return get_linux_runner_script(runner_type, gitlab_url, registration_token, storage_config)
-    elif runner_type.startswith('windows'):
-        return get_windows_runner_script(gitlab_url, registration_token, storage_config)
-    elif runner_type == 'macos':
-        return get_macos_runner_script(gitlab_url, registration_token, storage_config)
-    else:
-        return None
+# Install Docker (optional, for containers that support it)
+curl -fsSL https://get.docker.com | sh || echo "Docker installation skipped (may not be supported in LXC)"
+systemctl enable docker 2>/dev/null || true
+systemctl start docker 2>/dev/null || true
+{nfs_mount}
+{samba_mount}
+{install_runner}
+{register_section}
+echo "GitLab Runner ({distro}) installation complete!"
+'''
 
 
 def get_linux_runner_script(distro, gitlab_url, registration_token, storage_config=None):
     """Get Linux runner installation script."""
-    storage_config = storage_config or {}
+    storage_items = tuple(sorted((storage_config or {}).items()))
+    return _render_linux_runner_script(distro, gitlab_url, registration_token, storage_items)
+
+
+@lru_cache(maxsize=128)
+def _render_linux_runner_script(distro, gitlab_url, registration_token, storage_items):
+    """Render the Linux runner script; storage_items is storage_config as a sorted tuple."""
+    storage_config = dict(storage_items)
 
     # Determine package manager and qemu-guest-agent package name
     if distro in ['debian', 'ubuntu']:
@@ -2044,73 +3294,23 @@ apt-get install -y gitlab-runner
     # Only register if gitlab_url is provided
     register_section = ''
     if gitlab_url and registration_token:
-        register_section = f'''
-# Register runner with shell executor (works in containers without Docker)
-gitlab-runner register \\
-    --non-interactive \\
-    --url "{gitlab_url}" \\
-    --registration-token "{registration_token}" \\
-    --executor "shell" \\
-    --shell "bash" \\
-    --description "{distro}-runner" \\
-    --tag-list "linux,{distro},shell" \\
-    --run-untagged="true" \\
-    --locked="false"
-
-# Reinstall runner to run as root (needed for apt-get in CI jobs)
-gitlab-runner stop || true
-gitlab-runner uninstall || true
-gitlab-runner install --user root --working-directory /root
-gitlab-runner start
-'''
-
-    return f'''#!/bin/bash
-set -e
-export DEBIAN_FRONTEND=noninteractive
-
-# Fix DNS - use Google DNS as fallback
-if ! grep -q "8.8.8.8" /etc/resolv.conf 2>/dev/null; then
-    echo "nameserver 8.8.8.8" >> /etc/resolv.conf
-fi
-
-{install_qemu_ga}
-# Install essential packages including sudo
-apt-get update
-apt-get install -y sudo curl git ca-certificates
-
-# Install Docker (optional, for containers that support it)
-curl -fsSL https://get.docker.com | sh || echo "Docker installation skipped (may not be supported in LXC)"
-systemctl enable docker 2>/dev/null || true
-systemctl start docker 2>/dev/null || true
-{nfs_mount}
-{samba_mount}
-{install_runner}
-{register_section}
-echo "GitLab Runner ({distro}) installation complete!"
-'''
-
-
-def get_windows_runner_script(gitlab_url, registration_token, storage_config=None):
-    """Get Windows runner installation script (PowerShell)."""
-    storage_config = storage_config or {}
+        register_section = LINUX_RUNNER_REGISTER_TEMPLATE.format(
+            gitlab_url=shlex.quote(gitlab_url),
+            registration_token=shlex.quote(registration_token),
+            distro=distro
+        )
 
-    # Add shared storage mounting
-    nfs_mount = get_nfs_mount_script_windows(
-        storage_config.get('nfs_share', ''),
-        storage_config.get('nfs_mount_path', 'N:')
-    )
-    samba_mount = get_samba_mount_script_windows(
-        storage_config.get('samba_share', ''),
-        storage_config.get('samba_mount_path', 'S:'),
-        storage_config.get('samba_username', ''),
-        storage_config.get('samba_password', ''),
-        storage_config.get('samba_domain', '')
+    return LINUX_RUNNER_TEMPLATE.format(
+        install_qemu_ga=install_qemu_ga,
+        nfs_mount=nfs_mount,
+        samba_mount=samba_mount,
+        install_runner=install_runner,
+        register_section=register_section,
+        distro=distro
     )
 
-    # Only register if gitlab_url is provided
-    register_section = ''
-    if gitlab_url and registration_token:
-        register_section = f'''
+
+WINDOWS_RUNNER_REGISTER_TEMPLATE = '''
 # Register runner with powershell (not pwsh)
 cd C:\\GitLab-Runner
 .\\gitlab-runner.exe register `
@@ -2129,7 +3329,7 @@ cd C:\\GitLab-Runner
 .\\gitlab-runner.exe start
 '''
 
-    return f'''# PowerShell script for Windows GitLab Runner installation
+WINDOWS_RUNNER_TEMPLATE = '''# PowerShell script for Windows GitLab Runner installation
 $ErrorActionPreference = "Stop"
 
 # Install Chocolatey package manager
@@ -2168,26 +3368,25 @@ Write-Host "GitLab Runner (Windows) installation complete!"
 '''
 
 
-def get_macos_runner_script(gitlab_url, registration_token, storage_config=None):
-    """Get macOS runner installation script."""
-    storage_config = storage_config or {}
+def get_windows_runner_script(gitlab_url, registration_token, storage_config=None):
+    """Get Windows runner installation script (PowerShell)."""
+    storage_items = tuple(sorted((storage_config or {}).items()))
+    return _render_windows_runner_script(gitlab_url, registration_token, storage_items)
 
-    # Add shared storage mounting (NFS only for macOS, Samba via smb://)
-    nfs_mount = ''
-    if storage_config.get('nfs_share'):
-        nfs_share = storage_config.get('nfs_share', '')
-        nfs_mount_path = storage_config.get('nfs_mount_path', '/Volumes/NFSShare')
-        nfs_mount = f'''
-# Configure NFS shared storage
-echo "Setting up NFS share..."
-mkdir -p {nfs_mount_path}
-mount -t nfs {nfs_share} {nfs_mount_path}
-echo "NFS share mounted at {nfs_mount_path}"
-'''
 
-    samba_mount = get_samba_mount_script_macos(
+@lru_cache(maxsize=128)
+def _render_windows_runner_script(gitlab_url, registration_token, storage_items):
+    """Render the Windows runner script; storage_items is storage_config as a sorted tuple."""
+    storage_config = dict(storage_items)
+
+    # Add shared storage mounting
+    nfs_mount = get_nfs_mount_script_windows(
+        storage_config.get('nfs_share', ''),
+        storage_config.get('nfs_mount_path', 'N:')
+    )
+    samba_mount = get_samba_mount_script_windows(
         storage_config.get('samba_share', ''),
-        storage_config.get('samba_mount_path', '/Volumes/Shared'),
+        storage_config.get('samba_mount_path', 'S:'),
         storage_config.get('samba_username', ''),
         storage_config.get('samba_password', ''),
         storage_config.get('samba_domain', '')
@@ -2196,12 +3395,32 @@ echo "NFS share mounted at {nfs_mount_path}"
     # Only register if gitlab_url is provided
     register_section = ''
     if gitlab_url and registration_token:
-        register_section = f'''
+        register_section = WINDOWS_RUNNER_REGISTER_TEMPLATE.format(
+            gitlab_url=gitlab_url,
+            registration_token=registration_token
+        )
+
+    return WINDOWS_RUNNER_TEMPLATE.format(
+        nfs_mount=nfs_mount,
+        samba_mount=samba_mount,
+        register_section=register_section
+    )
+
+
+MACOS_NFS_MOUNT_TEMPLATE = '''
+# Configure NFS shared storage
+echo "Setting up NFS share..."
+mkdir -p {nfs_mount_path}
+mount -t nfs {nfs_share} {nfs_mount_path}
+echo "NFS share mounted at {nfs_mount_path}"
+'''
+
+MACOS_RUNNER_REGISTER_TEMPLATE = '''
 # Register runner
 gitlab-runner register \\
     --non-interactive \\
-    --url "{gitlab_url}" \\
-    --registration-token "{registration_token}" \\
+    --url {gitlab_url} \\
+    --registration-token {registration_token} \\
     --executor "shell" \\
     --description "macos-runner" \\
     --tag-list "macos,darwin,shell,xcode" \\
@@ -2212,7 +3431,7 @@ gitlab-runner register \\
 brew services start gitlab-runner
 '''
 
-    return f'''#!/bin/bash
+MACOS_RUNNER_TEMPLATE = '''#!/bin/bash
 set -e
 
 # Disable sleep/screensaver to keep runner available
@@ -2272,12 +3491,56 @@ echo "GitLab Runner (macOS) installation complete!"
 '''
 
 
-def get_nfs_mount_script_linux(nfs_share, mount_path='/mnt/shared'):
-    """Generate NFS mounting script for Linux systems."""
-    if not nfs_share:
-        return ''
+def get_macos_runner_script(gitlab_url, registration_token, storage_config=None):
+    """Get macOS runner installation script."""
+    storage_items = tuple(sorted((storage_config or {}).items()))
+    return _render_macos_runner_script(gitlab_url, registration_token, storage_items)
+
+
+@lru_cache(maxsize=128)
+def _render_macos_runner_script(gitlab_url, registration_token, storage_items):
+    """Render the macOS runner script; storage_items is storage_config as a sorted tuple."""
+    storage_config = dict(storage_items)
+
+    # Add shared storage mounting (NFS only for macOS, Samba via smb://)
+    nfs_mount = ''
+    if storage_config.get('nfs_share'):
+        nfs_share = storage_config.get('nfs_share', '')
+        nfs_mount_path = storage_config.get('nfs_mount_path', '/Volumes/NFSShare')
+        nfs_mount = MACOS_NFS_MOUNT_TEMPLATE.format(nfs_mount_path=nfs_mount_path, nfs_share=nfs_share)
+
+    samba_mount = get_samba_mount_script_macos(
+        storage_config.get('samba_share', ''),
+        storage_config.get('samba_mount_path', '/Volumes/Shared'),
+        storage_config.get('samba_username', ''),
+        storage_config.get('samba_password', ''),
+        storage_config.get('samba_domain', '')
+    )
+
+    # Only register if gitlab_url is provided
+    register_section = ''
+    if gitlab_url and registration_token:
+        register_section = MACOS_RUNNER_REGISTER_TEMPLATE.format(
+            gitlab_url=shlex.quote(gitlab_url),
+            registration_token=shlex.quote(registration_token)
+        )
 
-    return f'''
+    return MACOS_RUNNER_TEMPLATE.format(
+        nfs_mount=nfs_mount,
+        samba_mount=samba_mount,
+        register_section=register_section
+    )
+
+
+# Runner type -> script builder(gitlab_url, registration_token, storage_config)
+RUNNER_SCRIPT_FACTORIES = MappingProxyType({
+    **{distro: partial(get_linux_runner_script, distro) for distro in CT_TEMPLATES},
+    **{windows_type: get_windows_runner_script for windows_type in WINDOWS_TYPES},
+    'macos': get_macos_runner_script,
+})
+
+
+NFS_MOUNT_LINUX_TEMPLATE = '''
 # Configure NFS shared storage
 echo "Setting up NFS share..."
 apt-get install -y nfs-common || dnf install -y nfs-utils || pacman -Sy --noconfirm nfs-utils
@@ -2288,29 +3551,27 @@ echo "NFS share mounted at {mount_path}"
 '''
 
 
-def get_samba_mount_script_linux(samba_share, mount_path='/mnt/samba', username='', password='', domain=''):
-    """Generate Samba/CIFS mounting script for Linux systems."""
-    if not samba_share:
+@lru_cache(maxsize=128)
+def get_nfs_mount_script_linux(nfs_share, mount_path='/mnt/shared'):
+    """Generate NFS mounting script for Linux systems."""
+    if not nfs_share:
         return ''
 
-    credentials_setup = ''
-    mount_options = 'defaults,_netdev'
+    return NFS_MOUNT_LINUX_TEMPLATE.format(mount_path=mount_path, nfs_share=nfs_share)
 
-    if username and password:
-        credentials_setup = f'''
+
+SAMBA_CREDENTIALS_LINUX_TEMPLATE = '''
 # Create credentials file for Samba
 cat > /root/.smbcredentials << 'EOF'
 username={username}
 password={password}
 '''
-        if domain:
-            credentials_setup += f'domain={domain}\n'
-        credentials_setup += '''EOF
+
+SAMBA_CREDENTIALS_LINUX_END = '''EOF
 chmod 600 /root/.smbcredentials
 '''
-        mount_options = 'credentials=/root/.smbcredentials,_netdev'
 
-    return f'''
+SAMBA_MOUNT_LINUX_TEMPLATE = '''
 # Configure Samba/CIFS shared storage
 echo "Setting up Samba share..."
 apt-get install -y cifs-utils || dnf install -y cifs-utils || pacman -Sy --noconfirm cifs-utils
@@ -2322,6 +3583,43 @@ echo "Samba share mounted at {mount_path}"
 '''
 
 
+@lru_cache(maxsize=128)
+def get_samba_mount_script_linux(samba_share, mount_path='/mnt/samba', username='', password='', domain=''):
+    """Generate Samba/CIFS mounting script for Linux systems."""
+    if not samba_share:
+        return ''
+
+    credentials_setup = ''
+    mount_options = 'defaults,_netdev'
+
+    if username and password:
+        credentials_setup = ''.join([
+            SAMBA_CREDENTIALS_LINUX_TEMPLATE.format(username=username, password=password),
+            f'domain={domain}\n' if domain else '',
+            SAMBA_CREDENTIALS_LINUX_END,
+        ])
+        mount_options = 'credentials=/root/.smbcredentials,_netdev'
+
+    return SAMBA_MOUNT_LINUX_TEMPLATE.format(
+        mount_path=mount_path,
+        credentials_setup=credentials_setup,
+        samba_share=samba_share,
+        mount_options=mount_options
+    )
+
+
+NFS_MOUNT_WINDOWS_TEMPLATE = '''
+# Configure NFS shared storage
+Write-Host "Setting up NFS share..."
+Install-WindowsFeature -Name NFS-Client -ErrorAction SilentlyContinue
+$nfsDrive = "{mount_path}"
+$nfsPath = "\\\\{server}\\{windows_path}"
+New-PSDrive -Name ($nfsDrive.TrimEnd(':')) -PSProvider FileSystem -Root $nfsPath -Persist -ErrorAction SilentlyContinue
+Write-Host "NFS share mounted at $nfsDrive"
+'''
+
+
+@lru_cache(maxsize=128)
 def get_nfs_mount_script_windows(nfs_share, mount_path='N:'):
     """Generate NFS mounting script for Windows systems (PowerShell)."""
     if not nfs_share:
@@ -2337,17 +3635,26 @@ def get_nfs_mount_script_windows(nfs_share, mount_path='N:'):
     # Convert Unix path to Windows path (replace / with \)
     windows_path = path.replace('/', '\\')
 
-    return f'''
-# Configure NFS shared storage
-Write-Host "Setting up NFS share..."
-Install-WindowsFeature -Name NFS-Client -ErrorAction SilentlyContinue
-$nfsDrive = "{mount_path}"
-$nfsPath = "\\\\{server}\\{windows_path}"
-New-PSDrive -Name ($nfsDrive.TrimEnd(':')) -PSProvider FileSystem -Root $nfsPath -Persist -ErrorAction SilentlyContinue
-Write-Host "NFS share mounted at $nfsDrive"
+    return NFS_MOUNT_WINDOWS_TEMPLATE.format(mount_path=mount_path, server=server, windows_path=windows_path)
+
+
+SAMBA_CREDENTIAL_WINDOWS_TEMPLATE = '''
+$secPassword = ConvertTo-SecureString "{password}" -AsPlainText -Force
+$credential = New-Object System.Management.Automation.PSCredential("{username}", $secPassword)
+New-PSDrive -Name ($sambaDrive.TrimEnd(':')) -PSProvider FileSystem -Root $sambaPath -Credential $credential -Persist
+'''
+
+SAMBA_MOUNT_WINDOWS_TEMPLATE = '''
+# Configure Samba/CIFS shared storage
+Write-Host "Setting up Samba share..."
+$sambaDrive = "{mount_path}"
+$sambaPath = "\\\\{samba_share}"
+{credential_param}
+Write-Host "Samba share mounted at $sambaDrive"
 '''
 
 
+@lru_cache(maxsize=128)
 def get_samba_mount_script_windows(samba_share, mount_path='S:', username='', password='', domain=''):
     """Generate Samba/CIFS mounting script for Windows systems (PowerShell)."""
     if not samba_share:
@@ -2357,24 +3664,28 @@ def get_samba_mount_script_windows(samba_share, mount_path='S:', username='', pa
     if username and password:
         if domain:
             username = f"{domain}\\{username}"
-        credential_param = f'''
-$secPassword = ConvertTo-SecureString "{password}" -AsPlainText -Force
-$credential = New-Object System.Management.Automation.PSCredential("{username}", $secPassword)
-New-PSDrive -Name ($sambaDrive.TrimEnd(':')) -PSProvider FileSystem -Root $sambaPath -Credential $credential -Persist
-'''
+        credential_param = SAMBA_CREDENTIAL_WINDOWS_TEMPLATE.format(password=password, username=username)
     else:
         credential_param = f'New-PSDrive -Name ($sambaDrive.TrimEnd(\':\')) -PSProvider FileSystem -Root $sambaPath -Persist'
 
-    return f'''
+    return SAMBA_MOUNT_WINDOWS_TEMPLATE.format(
+        mount_path=mount_path,
+        samba_share=samba_share,
+        credential_param=credential_param
+    )
+
+
+SAMBA_MOUNT_MACOS_TEMPLATE = '''
 # Configure Samba/CIFS shared storage
-Write-Host "Setting up Samba share..."
-$sambaDrive = "{mount_path}"
-$sambaPath = "\\\\{samba_share}"
-{credential_param}
-Write-Host "Samba share mounted at $sambaDrive"
+echo "Setting up Samba share..."
+mkdir -p {mount_path}
+mount -t smbfs {auth_param} {mount_path}
+# Add to auto-mount (launchd would be needed for persistence)
+echo "Samba share mounted at {mount_path}"
 '''
 
 
+@lru_cache(maxsize=128)
 def get_samba_mount_script_macos(samba_share, mount_path='/Volumes/Shared', username='', password='', domain=''):
     """Generate Samba/CIFS mounting script for macOS systems."""
     if not samba_share:
@@ -2389,21 +3700,10 @@ def get_samba_mount_script_macos(samba_share, mount_path='/Volumes/Shared', user
     else:
         auth_param = f"smb://{samba_share}"
 
-    return f'''
-# Configure Samba/CIFS shared storage
-echo "Setting up Samba share..."
-mkdir -p {mount_path}
-mount -t smbfs {auth_param} {mount_path}
-# Add to auto-mount (launchd would be needed for persistence)
-echo "Samba share mounted at {mount_path}"
-'''
-
+    return SAMBA_MOUNT_MACOS_TEMPLATE.format(mount_path=mount_path, auth_param=auth_param)
 
-def get_harbor_install_script(admin_password='Harbor12345', enable_trivy=True):
-    """Get Harbor container registry installation script."""
-    trivy_flag = '--with-trivy' if enable_trivy else ''
 
-    return f'''#!/bin/bash
+HARBOR_INSTALL_TEMPLATE = '''#!/bin/bash
 set -e
 export DEBIAN_FRONTEND=noninteractive
 
@@ -2459,11 +3759,15 @@ echo "Default project: gitlab-builds"
 '''
 
 
-def get_rancher_install_script(bootstrap_password=''):
-    """Get Rancher server installation script."""
-    bootstrap_arg = f'--set bootstrapPassword={bootstrap_password}' if bootstrap_password else ''
+@lru_cache(maxsize=128)
+def get_harbor_install_script(admin_password='Harbor12345', enable_trivy=True):
+    """Get Harbor container registry installation script."""
+    trivy_flag = '--with-trivy' if enable_trivy else ''
 
-    return f'''#!/bin/bash
+    return HARBOR_INSTALL_TEMPLATE.format(admin_password=admin_password, trivy_flag=trivy_flag)
+
+
+RANCHER_INSTALL_TEMPLATE = '''#!/bin/bash
 set -e
 export DEBIAN_FRONTEND=noninteractive
 
@@ -2507,3 +3811,11 @@ echo "=== Rancher Installation Complete ==="
 echo "URL: https://$RANCHER_IP"
 echo "Initial setup requires the bootstrap password from the logs above."
 '''
+
+
+@lru_cache(maxsize=128)
+def get_rancher_install_script(bootstrap_password=''):
+    """Get Rancher server installation script."""
+    bootstrap_arg = f'--set bootstrapPassword={bootstrap_password}' if bootstrap_password else ''
+
+    return RANCHER_INSTALL_TEMPLATE.format(bootstrap_password=bootstrap_password)
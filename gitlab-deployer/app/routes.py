@@ -1,20 +1,182 @@
 """Flask routes for GitLab Build Farm Deployer"""
-from flask import Blueprint, render_template, request, jsonify, session, make_response
+from flask import Blueprint, current_app, render_template, request, jsonify, make_response, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.http import generate_etag
 import subprocess
+import hashlib
 import json
 import os
+import re
 import time
 import threading
 from pathlib import Path
 from functools import wraps
-from .models import SavedConfig, DeploymentHistory, SSHKey, Credential, init_db
+from types import MappingProxyType
+from .models import SavedConfig, DeploymentHistory, SSHKey, Credential
+
+try:
+    import orjson
+except ImportError:  # optional - stdlib json is used without it
+    orjson = None
 
 bp = Blueprint('main', __name__)
 
+# Deployment config and logs live alongside the data directory (see models.py)
+BASE_DIR = Path(__file__).parent.parent.parent
+CONFIG_DIR = BASE_DIR / 'config'
+CONFIG_DIR.mkdir(exist_ok=True)
+DEPLOYMENT_CONFIG_FILE = CONFIG_DIR / 'deployment_config.json'
+LOGS_DIR = BASE_DIR / 'logs'
+LOGS_DIR.mkdir(exist_ok=True)
+
+# Parsed deployment_config.json, keyed by its file_version()
+deployment_config_cache = {}
+
+
+def file_version(path):
+    """(size, mtime_ns) of a file, or None if it doesn't exist."""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def read_json_file(path):
+    """Parse a JSON file, with orjson when it's installed."""
+    data = path.read_bytes()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_deployment_config():
+    """Parsed deployment_config.json, or None if there is none.
+
+    The file is only re-read when its size or mtime changes. The returned
+    dict is shared between calls, so callers must not modify it.
+    """
+    version = file_version(DEPLOYMENT_CONFIG_FILE)
+    if version is None:
+        return None
+    config = deployment_config_cache.get(version)
+    if config is None:
+        config = read_json_file(DEPLOYMENT_CONFIG_FILE)
+        deployment_config_cache.clear()
+        deployment_config_cache[version] = config
+    return config
+
+
+def write_deployment_config(config):
+    """Replace deployment_config.json atomically.
+
+    The config is written to a temp file next to it and renamed over it, so
+    a reader never sees a half-written file, even if the write fails.
+    """
+    tmp = DEPLOYMENT_CONFIG_FILE.with_name(
+        f'{DEPLOYMENT_CONFIG_FILE.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    )
+    try:
+        if orjson is not None:
+            tmp.write_bytes(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp, 'w') as f:
+                json.dump(config, f, indent=2)
+        os.replace(tmp, DEPLOYMENT_CONFIG_FILE)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
 # Global provisioning status tracker
 provisioning_status = {}
 provisioning_lock = threading.Lock()
 
+# Background deployment runs, keyed by deployment ID (see execute_deployment)
+deployment_jobs = {}
+deployment_jobs_lock = threading.Lock()
+
+# Deployment plan steps from deploy(), keyed by deployment ID
+deployment_plans = {}
+
+# Most deployments whose jobs, plans and parsed progress are kept in memory;
+# the oldest finished ones are dropped first (see prune_deployment_state)
+MAX_TRACKED_DEPLOYMENTS = 100
+
+# Provisioning threads a deployment leaves running after it returns (GitLab
+# reconfigure, runner installs), keyed by deployment ID; run_deployment_job()
+# keeps the job incomplete until they finish
+provisioning_threads = {}
+
+# Deployment IDs are the GitLab domain and name files under LOGS_DIR
+DEPLOYMENT_ID_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,252}')
+
+
+def valid_deployment_id(deployment_id):
+    return bool(DEPLOYMENT_ID_PATTERN.fullmatch(deployment_id)) and '..' not in deployment_id
+
+
+def prune_deployment_state():
+    """Cap deployment_jobs, deployment_plans and progress_cache at MAX_TRACKED_DEPLOYMENTS.
+
+    Entries go oldest first; running deployments are never dropped. Call
+    with deployment_jobs_lock held.
+    """
+    for table in (deployment_jobs, deployment_plans, progress_cache):
+        for deployment_id in list(table):
+            if len(table) <= MAX_TRACKED_DEPLOYMENTS:
+                break
+            job = deployment_jobs.get(deployment_id)
+            if job is None or job['completed']:
+                del table[deployment_id]
+
+# Connected ProxmoxClients, keyed by a digest of the connection settings
+# (see get_proxmox_client), and one lock per key so a client is only built once
+proxmox_clients = {}
+proxmox_client_locks = {}
+proxmox_clients_lock = threading.Lock()
+# Reconnect well before a Proxmox auth ticket (valid 2h) runs out
+PROXMOX_CLIENT_TTL = 3600
+
+
+def get_proxmox_client(host, user, password, port=8006, verify_ssl=False):
+    """Connected ProxmoxClient for these settings, reused across requests.
+
+    Saves the ticket request and TLS handshake on every deployment, and lets
+    deployments share the client's caches. Clients are keyed by a digest of
+    the settings including the password, so one is only handed back for the
+    credentials it was made with. Expired clients are dropped on every call.
+    A failed connect() is raised to the caller and not cached.
+    """
+    from .proxmox_client import ProxmoxClient
+
+    key = hashlib.sha256(repr((host, port, user, password, verify_ssl)).encode()).hexdigest()
+    with proxmox_clients_lock:
+        now = time.monotonic()
+        for stale in [k for k, (_, created) in proxmox_clients.items() if now - created >= PROXMOX_CLIENT_TTL]:
+            del proxmox_clients[stale]
+            proxmox_client_locks.pop(stale, None)
+        cached = proxmox_clients.get(key)
+        if cached:
+            return cached[0]
+        key_lock = proxmox_client_locks.setdefault(key, threading.Lock())
+
+    # Concurrent callers with the same settings wait for one connect()
+    with key_lock:
+        with proxmox_clients_lock:
+            cached = proxmox_clients.get(key)
+            if cached:
+                return cached[0]
+        client = ProxmoxClient(host=host, port=port, user=user, password=password, verify_ssl=verify_ssl)
+        try:
+            client.connect()
+        except Exception:
+            with proxmox_clients_lock:
+                proxmox_client_locks.pop(key, None)
+            raise
+        with proxmox_clients_lock:
+            proxmox_clients[key] = (client, time.monotonic())
+    return client
+
 
 def check_gitlab_server(url, timeout=10):
     """Check if a GitLab server is accessible and responding"""
@@ -65,29 +227,40 @@ def no_cache(f):
 
 @bp.after_request
 def add_cache_headers(response):
-    """Add no-cache headers to all API responses"""
+    """Add no-cache headers to all API responses.
+
+    Responses carrying an ETag may be stored but must be revalidated, so
+    pollers get a 304 instead of the full body when nothing changed.
+    """
     if request.path.startswith('/api/'):
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        if 'ETag' in response.headers:
+            response.headers['Cache-Control'] = 'no-cache'
+        else:
+            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
     return response
 
-SUPPORTED_RUNNERS = {
-    'windows-10': {'name': 'Windows 10', 'tags': 'windows,windows-10,desktop'},
-    'windows-11': {'name': 'Windows 11', 'tags': 'windows,windows-11,desktop'},
-    'windows-server-2022': {'name': 'Windows Server 2022', 'tags': 'windows,server,2022'},
-    'windows-server-2025': {'name': 'Windows Server 2025', 'tags': 'windows,server,2025'},
-    'debian': {'name': 'Debian', 'tags': 'linux,debian'},
-    'ubuntu': {'name': 'Ubuntu', 'tags': 'linux,ubuntu'},
-    'arch': {'name': 'Arch Linux', 'tags': 'linux,arch'},
-    'rocky': {'name': 'Rocky Linux', 'tags': 'linux,rocky,rhel'},
-    'macos': {'name': 'macOS', 'tags': 'macos,darwin'}
-}
-
-SUPPORTED_SERVICES = {
-    'harbor': {'name': 'Harbor Registry', 'description': 'Enterprise container registry'},
-    'rancher': {'name': 'Rancher Server', 'description': 'Kubernetes management platform'}
-}
+SUPPORTED_RUNNERS = MappingProxyType({
+    'windows-10': MappingProxyType({'name': 'Windows 10', 'tags': 'windows,windows-10,desktop'}),
+    'windows-11': MappingProxyType({'name': 'Windows 11', 'tags': 'windows,windows-11,desktop'}),
+    'windows-server-2022': MappingProxyType({'name': 'Windows Server 2022', 'tags': 'windows,server,2022'}),
+    'windows-server-2025': MappingProxyType({'name': 'Windows Server 2025', 'tags': 'windows,server,2025'}),
+    'debian': MappingProxyType({'name': 'Debian', 'tags': 'linux,debian'}),
+    'ubuntu': MappingProxyType({'name': 'Ubuntu', 'tags': 'linux,ubuntu'}),
+    'arch': MappingProxyType({'name': 'Arch Linux', 'tags': 'linux,arch'}),
+    'rocky': MappingProxyType({'name': 'Rocky Linux', 'tags': 'linux,rocky,rhel'}),
+    'macos': MappingProxyType({'name': 'macOS', 'tags': 'macos,darwin'})
+})
+
+SUPPORTED_RUNNER_IDS = frozenset(SUPPORTED_RUNNERS)
+# Runners deployed as LXC containers; the rest are VMs
+LINUX_RUNNERS = frozenset({'debian', 'ubuntu', 'arch', 'rocky'})
+
+SUPPORTED_SERVICES = MappingProxyType({
+    'harbor': MappingProxyType({'name': 'Harbor Registry', 'description': 'Enterprise container registry'}),
+    'rancher': MappingProxyType({'name': 'Rancher Server', 'description': 'Kubernetes management platform'})
+})
 
 @bp.route('/')
 def index():
@@ -138,9 +311,9 @@ def deploy():
             'error': 'At least one runner must be selected'
         }), 400
 
-    # Validate runners
-    invalid_runners = [r for r in runners if r not in SUPPORTED_RUNNERS]
-    if invalid_runners:
+    # Validate runners (the error list is only built when something's invalid)
+    if not SUPPORTED_RUNNER_IDS.issuperset(runners):
+        invalid_runners = [r for r in runners if r not in SUPPORTED_RUNNER_IDS]
         return jsonify({
             'success': False,
             'error': f'Invalid runners: {", ".join(invalid_runners)}'
@@ -206,12 +379,7 @@ def deploy():
     }
 
     # Save config to file for deployment script
-    config_dir = Path(__file__).parent.parent.parent / 'config'
-    config_dir.mkdir(exist_ok=True)
-    config_file = config_dir / 'deployment_config.json'
-
-    with open(config_file, 'w') as f:
-        json.dump(config, f, indent=2)
+    write_deployment_config(config)
 
     # Create deployment plan
     deployment_steps = []
@@ -265,9 +433,10 @@ def deploy():
         deployment_steps.append('Verify all runners are connected')
     deployment_steps.append('Deployment complete')
 
-    # Store in session for status tracking
-    session['deployment_id'] = data['domain']
-    session['deployment_steps'] = deployment_steps
+    # Keep the plan server-side for status tracking
+    with deployment_jobs_lock:
+        deployment_plans[data['domain']] = deployment_steps
+        prune_deployment_state()
 
     # Generate deployment message
     services = data.get('services', [])
@@ -347,15 +516,14 @@ def provision_gitlab_manual():
         }), 400
 
     try:
-        from .proxmox_client import ProxmoxClient, get_gitlab_install_script
+        from .proxmox_client import get_gitlab_install_script
 
-        client = ProxmoxClient(
+        client = get_proxmox_client(
             host=provider_config['host'],
             user=provider_config.get('user', 'root@pam'),
             password=provider_config['password'],
             verify_ssl=provider_config.get('verify_ssl', False)
         )
-        client.connect()  # MUST connect before using!
 
         # Get the node where the container is running - try to auto-detect
         nodes = client.get_nodes()
@@ -480,42 +648,111 @@ def execute_deployment():
             'error': 'No deployment ID provided'
         }), 400
 
-    # Load deployment config
-    config_dir = Path(__file__).parent.parent.parent / 'config'
-    config_file = config_dir / 'deployment_config.json'
-
-    if not config_file.exists():
+    if not isinstance(deployment_id, str) or not valid_deployment_id(deployment_id):
         return jsonify({
             'success': False,
-            'error': 'No deployment configuration found. Please configure deployment first.'
+            'error': 'Invalid deployment ID'
         }), 400
 
+    # Load deployment config
     try:
-        with open(config_file, 'r') as f:
-            config = json.load(f)
+        config = load_deployment_config()
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Failed to load deployment config: {str(e)}'
         }), 500
 
+    if config is None:
+        return jsonify({
+            'success': False,
+            'error': 'No deployment configuration found. Please configure deployment first.'
+        }), 400
+
     provider = config.get('provider', 'docker')
 
-    try:
-        if provider == 'docker':
-            return execute_docker_deployment(config, deployment_id)
-        elif provider == 'proxmox':
-            return execute_proxmox_deployment(config, deployment_id)
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'Unsupported provider: {provider}'
-            }), 400
-    except Exception as e:
+    if provider == 'docker':
+        deploy = execute_docker_deployment
+    elif provider == 'proxmox':
+        deploy = execute_proxmox_deployment
+    else:
         return jsonify({
             'success': False,
-            'error': str(e)
-        }), 500
+            'error': f'Unsupported provider: {provider}'
+        }), 400
+
+    # Deployments take minutes; run them off the request thread and let the
+    # client pick up the result from /api/status/<deployment_id>
+    with deployment_jobs_lock:
+        job = deployment_jobs.get(deployment_id)
+        if job and not job['completed']:
+            return jsonify({
+                'success': True,
+                'started': False,
+                'deployment_id': deployment_id,
+                'message': 'Deployment is already running'
+            }), 202
+        deployment_jobs[deployment_id] = {
+            'completed': False,
+            'progress': 10,
+            'current_step': 'Deploying GitLab Server...'
+        }
+
+    # A redeploy starts a fresh log; the previous run's is kept as .log.1
+    log_file = LOGS_DIR / f'{deployment_id}.log'
+    try:
+        os.replace(log_file, log_file.with_name(f'{deployment_id}.log.1'))
+    except FileNotFoundError:
+        pass
+
+    thread = threading.Thread(
+        target=run_deployment_job,
+        args=(current_app._get_current_object(), deploy, config, deployment_id),
+        daemon=True
+    )
+    thread.start()
+
+    return jsonify({
+        'success': True,
+        'started': True,
+        'deployment_id': deployment_id,
+        'message': 'Deployment started'
+    }), 202
+
+
+def run_deployment_job(app, deploy, config, deployment_id):
+    """Run a deployment in the background and record its result for deployment_status()."""
+    with app.app_context():
+        try:
+            response = deploy(config, deployment_id)
+            if isinstance(response, tuple):
+                response = response[0]
+            result = response.get_json()
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+    # Runner output keeps arriving in the log until provisioning is done
+    with deployment_jobs_lock:
+        thread = provisioning_threads.pop(deployment_id, None)
+        if thread is not None:
+            deployment_jobs[deployment_id] = {
+                'completed': False,
+                'progress': 90,
+                'current_step': 'Provisioning runners...'
+            }
+    if thread is not None:
+        thread.join()
+
+    with deployment_jobs_lock:
+        # Re-inserted so the finished job is the newest entry for pruning
+        deployment_jobs.pop(deployment_id, None)
+        deployment_jobs[deployment_id] = {
+            'completed': True,
+            'progress': 100,
+            'current_step': 'Deployment finished' if result.get('success') else 'Deployment failed',
+            'result': result
+        }
+        prune_deployment_state()
 
 
 def execute_docker_deployment(config, deployment_id):
@@ -534,12 +771,14 @@ def execute_docker_deployment(config, deployment_id):
     compose_cmd = shutil.which('docker-compose') or shutil.which('docker')
 
     try:
-        # Test Docker connection
+        # Test Docker connection (close_fds=False lets subprocess use
+        # posix_spawn() rather than fork() the server process)
         result = subprocess.run(
             [docker_cmd, 'info'],
             capture_output=True,
             text=True,
-            timeout=30
+            timeout=30,
+            close_fds=False
         )
 
         if result.returncode != 0:
@@ -590,9 +829,8 @@ def execute_proxmox_deployment(config, deployment_id):
     # Import proxmox_client with proper error handling for missing dependencies
     try:
         from .proxmox_client import (
-            ProxmoxClient, get_gitlab_install_script, get_runner_install_script,
-            get_linux_credential_script, get_windows_credential_script,
-            get_windows_ssh_key_script, get_macos_credential_script
+            get_gitlab_install_script, get_runner_install_script,
+            get_linux_credential_script
         )
     except ImportError as e:
         missing_module = str(e)
@@ -610,15 +848,14 @@ def execute_proxmox_deployment(config, deployment_id):
         }), 400
 
     try:
-        # Create client and connect
-        client = ProxmoxClient(
+        # Connected client (reused if this Proxmox was used recently)
+        client = get_proxmox_client(
             host=provider_config.get('host'),
             port=provider_config.get('port', 8006),
             user=provider_config.get('user'),
             password=provider_config.get('password'),
             verify_ssl=provider_config.get('verify_ssl', False)
         )
-        client.connect()
 
         # Get target node
         nodes = client.get_nodes()
@@ -697,6 +934,7 @@ def execute_proxmox_deployment(config, deployment_id):
         # Step 1: Create GitLab Server (LXC Container) - Only if deploy_gitlab is True
         # =====================================================================
         print(f"[DEPLOY] deploy_gitlab={deploy_gitlab}")
+        gitlab_reconfigure = None
         if deploy_gitlab:
           print(f"[DEPLOY] Creating GitLab container...")
           try:
@@ -755,34 +993,45 @@ def execute_proxmox_deployment(config, deployment_id):
 
                 # Provision GitLab SYNCHRONOUSLY - no background thread
                 print(f"[PROVISION] Starting GitLab provisioning for VMID {gitlab_vmid}...")
+                scripts = []
 
                 # First inject credentials if specified
                 if deploy_credential:
                     print(f"[PROVISION] Injecting credentials for user {deploy_credential['username']}...")
-                    cred_script = get_linux_credential_script(
+                    scripts.append(get_linux_credential_script(
                         username=deploy_credential['username'],
                         password=deploy_credential.get('password'),
                         ssh_public_key=deploy_credential.get('ssh_public_key')
-                    )
-                    cred_result = client.provision_container(selected_node, gitlab_vmid, cred_script)
-                    if not cred_result.get('success'):
-                        print(f"[PROVISION] Credential injection failed: {cred_result.get('error')}")
-                    else:
-                        print(f"[PROVISION] Credentials injected successfully")
+                    ))
                     created[-1]['credential'] = deploy_credential['name']
 
                 # Install GitLab
                 print(f"[PROVISION] Installing GitLab (this may take 10-15 minutes)...")
-                script = get_gitlab_install_script(
+                scripts.append(get_gitlab_install_script(
                     domain=domain,
                     admin_password=admin_password,
                     letsencrypt_email=email if config.get('letsencrypt_enabled') else None,
-                    storage_config=storage_config
+                    storage_config=storage_config,
+                    detach_reconfigure=True
+                ))
+
+                # Credentials and install share one session; a failed credential
+                # step is logged but does not block the GitLab install
+                prov_result = client.provision_container_batch(
+                    selected_node, gitlab_vmid, scripts, stop_on_error=False
                 )
-                prov_result = client.provision_container(selected_node, gitlab_vmid, script)
+                if deploy_credential:
+                    cred_steps = [r for r in prov_result.get('results', []) if r['index'] == 0]
+                    if cred_steps and cred_steps[0]['exit_code'] == 0:
+                        print(f"[PROVISION] Credentials injected successfully")
+                    else:
+                        print(f"[PROVISION] Credential injection failed")
                 if prov_result.get('success'):
-                    print(f"[PROVISION] GitLab installation COMPLETE for VMID {gitlab_vmid}")
-                    created[-1]['status'] = 'running'
+                    # gitlab-ctl reconfigure keeps running in the container; it is
+                    # waited on in the background before runners are provisioned
+                    print(f"[PROVISION] GitLab installed for VMID {gitlab_vmid}, reconfiguring in background")
+                    created[-1]['status'] = 'configuring'
+                    gitlab_reconfigure = (selected_node, gitlab_vmid)
                 else:
                     error_msg = prov_result.get('error', 'Unknown error')
                     print(f"[PROVISION] GitLab installation FAILED: {error_msg}")
@@ -797,14 +1046,24 @@ def execute_proxmox_deployment(config, deployment_id):
         # =====================================================================
         # Step 2: Create Runner VMs/Containers
         # =====================================================================
+        runner_jobs = []
+
+        # Fetch base Windows ISOs for all Windows runners up front, in parallel;
+        # create_unattended_windows_iso() below then finds them in storage
+        iso_prefetch = [
+            runner for runner in runners
+            if runner.startswith('windows') and not provider_config.get('windows_isos', {}).get(runner)
+        ]
+        if iso_prefetch:
+            client.ensure_vm_images(iso_prefetch, selected_node, provider_config.get('iso_storage', 'local'))
 
-        for runner in runners:
+        runner_vmids = client.get_next_vmids(len(runners)) if runners else []
+        for runner, runner_vmid in zip(runners, runner_vmids):
             try:
-                runner_vmid = client.get_next_vmid()
                 runner_name = f'runner-{runner}-{runner_vmid}'
                 runner_config = client.RUNNER_RESOURCES.get(runner, {})
 
-                is_linux = runner in ['debian', 'ubuntu', 'arch', 'rocky']
+                is_linux = runner in LINUX_RUNNERS
                 is_windows = runner.startswith('windows')
                 is_macos = runner == 'macos'
 
@@ -843,35 +1102,31 @@ def execute_proxmox_deployment(config, deployment_id):
                             'resources': f'{runner_config.get("cores", 2)} CPU, {runner_config.get("memory", 4096)//1024}GB RAM, {runner_config.get("disk", 40)}GB disk'
                         })
 
-                        # Provision runner in background
-                        def provision_runner(vmid, rtype, cred):
-                            ip = client.get_container_ip(selected_node, vmid)
-                            if ip:
-                                # First inject credentials if specified
-                                if cred:
-                                    cred_script = get_linux_credential_script(
-                                        username=cred['username'],
-                                        password=cred.get('password'),
-                                        ssh_public_key=cred.get('ssh_public_key')
-                                    )
-                                    client.provision_container(selected_node, vmid, cred_script)
-
-                                # Then install runner
-                                # Note: registration_token would come from GitLab API after it's running
-                                script = get_runner_install_script(
-                                    rtype,
-                                    final_gitlab_url if final_gitlab_url else '',
-                                    'REGISTRATION_TOKEN' if final_gitlab_url else '',
-                                    storage_config
-                                )
-                                client.provision_container(selected_node, vmid, script)
-
-                        thread = threading.Thread(
-                            target=provision_runner,
-                            args=(runner_vmid, runner, deploy_credential),
-                            daemon=True
-                        )
-                        thread.start()
+                        # Queue runner provisioning - all Linux runners are provisioned
+                        # together in the background once every runner is created
+                        scripts = []
+                        # First inject credentials if specified
+                        if deploy_credential:
+                            scripts.append(get_linux_credential_script(
+                                username=deploy_credential['username'],
+                                password=deploy_credential.get('password'),
+                                ssh_public_key=deploy_credential.get('ssh_public_key')
+                            ))
+
+                        # Then install runner
+                        # Note: registration_token would come from GitLab API after it's running
+                        scripts.append(get_runner_install_script(
+                            runner,
+                            final_gitlab_url if final_gitlab_url else '',
+                            'REGISTRATION_TOKEN' if final_gitlab_url else '',
+                            storage_config
+                        ))
+                        runner_jobs.append({
+                            'node': selected_node,
+                            'vmid': runner_vmid,
+                            'scripts': scripts,
+                            'stop_on_error': False
+                        })
                         created[-1]['status'] = 'provisioning'
                         if deploy_credential:
                             created[-1]['credential'] = deploy_credential['name']
@@ -1063,6 +1318,29 @@ def execute_proxmox_deployment(config, deployment_id):
             except Exception as e:
                 errors.append(f'{runner}: {str(e)}')
 
+        # Provision Linux runners in background with bounded concurrency, once
+        # GitLab has finished reconfiguring (runners register against it)
+        def finish_provisioning(gitlab_reconfigure, runner_jobs):
+            if gitlab_reconfigure:
+                reconfigure_result = client.wait_for_gitlab_reconfigure(*gitlab_reconfigure)
+                if reconfigure_result.get('success'):
+                    print(f"[PROVISION] GitLab installation COMPLETE for VMID {gitlab_reconfigure[1]}")
+                else:
+                    print(f"[PROVISION] GitLab reconfigure FAILED: {reconfigure_result.get('error')}")
+            if runner_jobs:
+                # Runner output goes to the log deployment_status() serves
+                client.provision_many(runner_jobs, log_file=LOGS_DIR / f'{deployment_id}.log')
+
+        if gitlab_reconfigure or runner_jobs:
+            thread = threading.Thread(
+                target=finish_provisioning,
+                args=(gitlab_reconfigure, runner_jobs),
+                daemon=True
+            )
+            thread.start()
+            with deployment_jobs_lock:
+                provisioning_threads[deployment_id] = thread
+
         # =====================================================================
         # Step 3: Deploy Additional Services (Harbor, Rancher)
         # =====================================================================
@@ -1298,32 +1576,137 @@ def execute_proxmox_deployment(config, deployment_id):
             'error': f'Proxmox deployment failed: {str(e)}'
         }), 500
 
+# Most log bytes one /api/status response carries; clients page with ?since=
+MAX_LOG_CHUNK = 1024 * 1024
+
+# Parsed .progress files by deployment ID, as (file_version(), data)
+progress_cache = {}
+
+
+def read_log_chunk(path, offset, limit=MAX_LOG_CHUNK):
+    """Read up to limit bytes of a log file starting at offset.
+
+    One open and one positioned read, however big the log has grown. An
+    offset past the end (the log was recreated) reads from the start, and a
+    chunk cut short by limit ends at its last complete line when it has one.
+    Returns (data, next_offset, size), or (b'', 0, 0) if there is no log.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return b'', 0, 0
+    try:
+        size = os.fstat(fd).st_size
+        if offset > size:
+            offset = 0
+        length = min(size - offset, limit)
+        if hasattr(os, 'pread'):
+            data = os.pread(fd, length, offset)
+        else:  # Windows
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, length)
+    finally:
+        os.close(fd)
+
+    if offset + len(data) < size:
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            data = data[:cut]
+    return data, offset + len(data), size
+
+
 @bp.route('/api/status/<deployment_id>')
 def deployment_status(deployment_id):
-    """Check deployment status and progress"""
-    log_file = Path(__file__).parent.parent.parent / 'logs' / f'{deployment_id}.log'
-    progress_file = Path(__file__).parent.parent.parent / 'logs' / f'{deployment_id}.progress'
+    """Check deployment status and progress.
+
+    Pass ?since=<offset> to get only the log written after that byte offset,
+    at most MAX_LOG_CHUNK at a time; 'next_offset' in the response is the
+    offset to send next time and 'total_size' the log's current size. The
+    response has a weak ETag, so an unchanged status is answered with 304.
+    The raw log is served by /api/logs/<deployment_id>.
+    """
+    if not valid_deployment_id(deployment_id):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid deployment ID'
+        }), 400
+
+    log_file = LOGS_DIR / f'{deployment_id}.log'
+    progress_file = LOGS_DIR / f'{deployment_id}.progress'
+    since = request.args.get('since', 0, type=int)
+
+    # Plan from deploy() and background run started by execute_deployment()
+    with deployment_jobs_lock:
+        steps = deployment_plans.get(deployment_id)
+        job = deployment_jobs.get(deployment_id)
+
+    log_version = file_version(log_file)
+    progress_version = file_version(progress_file)
+    # A digest of the state, so every worker process derives the same tag
+    etag = generate_etag(repr((
+        since, log_version, progress_version, steps,
+        (job['completed'], job['current_step']) if job else None
+    )).encode())
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag, weak=True)
+        return response
 
     progress_data = {
         'success': True,
         'logs': '',
+        'next_offset': 0,
+        'total_size': 0,
         'progress': 0,
         'current_step': 'Initializing...',
         'completed': False
     }
 
-    # Read logs
-    if log_file.exists():
-        with open(log_file, 'r') as f:
-            progress_data['logs'] = f.read()
+    # Read logs (read_log_chunk() copes with a missing log itself)
+    data, next_offset, size = read_log_chunk(log_file, max(since, 0))
+    progress_data['logs'] = data.decode(errors='replace')
+    progress_data['next_offset'] = next_offset
+    progress_data['total_size'] = size
+
+    # Read progress, re-parsing the file only when it has changed
+    if progress_version:
+        cached = progress_cache.get(deployment_id)
+        if cached and cached[0] == progress_version:
+            progress = cached[1]
+        else:
+            try:
+                progress = read_json_file(progress_file)
+            except FileNotFoundError:
+                progress = {}
+            with deployment_jobs_lock:
+                progress_cache[deployment_id] = (progress_version, progress)
+                prune_deployment_state()
+        progress_data.update(progress)
+
+    if steps:
+        progress_data['steps'] = steps
+    if job:
+        progress_data.update(job)
+
+    response = jsonify(progress_data)
+    response.set_etag(etag, weak=True)
+    return response
 
-    # Read progress
-    if progress_file.exists():
-        with open(progress_file, 'r') as f:
-            progress = json.load(f)
-            progress_data.update(progress)
+@bp.route('/api/logs/<deployment_id>')
+def deployment_logs(deployment_id):
+    """Serve a deployment's log as plain text.
 
-    return jsonify(progress_data)
+    Conditional and Range requests are handled by Werkzeug, so a client can
+    fetch just the new bytes with 'Range: bytes=<offset>-' and no JSON
+    escaping is done on the log body.
+    """
+    try:
+        return send_from_directory(LOGS_DIR, f'{deployment_id}.log', mimetype='text/plain')
+    except NotFound:
+        return jsonify({
+            'success': False,
+            'error': 'No log for this deployment'
+        }), 404
 
 @bp.route('/health')
 def health():
@@ -1585,9 +1968,47 @@ def delete_ssh_key(key_id):
         }), 500
 
 
+# Uploaded SSH key files: size cap per key and per upload request, and the
+# prefixes a key file may start with (OpenSSH/PEM, RFC 4716, public keys)
+MAX_SSH_KEY_BYTES = 32 * 1024
+MAX_SSH_KEY_REQUEST_BYTES = 128 * 1024
+SSH_KEY_PREFIXES = (b'-----BEGIN ', b'---- BEGIN SSH2 ', b'ssh-', b'ecdsa-', b'sk-')
+
+
+def key_upload_too_large():
+    """413 response if the request body is too big to be a key upload, else None."""
+    if request.content_length and request.content_length > MAX_SSH_KEY_REQUEST_BYTES:
+        return jsonify({
+            'success': False,
+            'error': f'Upload too large (max {MAX_SSH_KEY_REQUEST_BYTES // 1024} KB per request)'
+        }), 413
+    return None
+
+
+def read_ssh_key_upload(file):
+    """Read an uploaded SSH key file, checking it looks like a key before decoding.
+
+    Reads at most MAX_SSH_KEY_BYTES + 1 bytes; raises ValueError if the file is
+    larger than MAX_SSH_KEY_BYTES, doesn't start like a key, or isn't UTF-8.
+    """
+    data = file.stream.read(MAX_SSH_KEY_BYTES + 1)
+    if len(data) > MAX_SSH_KEY_BYTES:
+        raise ValueError(f'Key file too large (max {MAX_SSH_KEY_BYTES // 1024} KB)')
+    if not data.lstrip().startswith(SSH_KEY_PREFIXES):
+        raise ValueError('File does not look like an SSH key')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError('Key file is not valid UTF-8 text')
+
+
 @bp.route('/api/ssh-keys/upload', methods=['POST'])
 def upload_ssh_key():
     """Upload an SSH key file"""
+    too_large = key_upload_too_large()
+    if too_large:
+        return too_large
+
     if 'file' not in request.files:
         return jsonify({
             'success': False,
@@ -1607,7 +2028,14 @@ def upload_ssh_key():
         }), 400
 
     try:
-        key_content = file.read().decode('utf-8')
+        key_content = read_ssh_key_upload(file)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    try:
         key_type = 'public' if file_ext == '.pub' else 'private'
 
         key_id = SSHKey.create(
@@ -1632,13 +2060,20 @@ def upload_ssh_key():
 # Utility Endpoints
 # ============================================================================
 
+# /api/runners body never changes - serialize it once (in jsonify()'s compact form)
+RUNNERS_JSON = (json.dumps({
+    'success': True,
+    'runners': {runner_id: dict(info) for runner_id, info in SUPPORTED_RUNNERS.items()}
+}, sort_keys=True, separators=(',', ':')) + '\n').encode()
+RUNNERS_ETAG = generate_etag(RUNNERS_JSON)
+
+
 @bp.route('/api/runners')
 def get_runners():
     """Get list of supported runners"""
-    return jsonify({
-        'success': True,
-        'runners': SUPPORTED_RUNNERS
-    })
+    response = current_app.response_class(RUNNERS_JSON, mimetype='application/json')
+    response.set_etag(RUNNERS_ETAG)
+    return response.make_conditional(request)
 
 
 # ============================================================================
@@ -2139,6 +2574,10 @@ def generate_credential():
 @bp.route('/api/credentials/upload-key', methods=['POST'])
 def upload_credential_key():
     """Upload SSH key files to create or update a credential"""
+    too_large = key_upload_too_large()
+    if too_large:
+        return too_large
+
     name = request.form.get('name')
     username = request.form.get('username')
     password = request.form.get('password')
@@ -2153,17 +2592,23 @@ def upload_credential_key():
     ssh_public_key = None
     ssh_private_key = None
 
-    # Handle public key upload
-    if 'public_key' in request.files:
-        public_key_file = request.files['public_key']
-        if public_key_file.filename:
-            ssh_public_key = public_key_file.read().decode('utf-8').strip()
-
-    # Handle private key upload
-    if 'private_key' in request.files:
-        private_key_file = request.files['private_key']
-        if private_key_file.filename:
-            ssh_private_key = private_key_file.read().decode('utf-8').strip()
+    try:
+        # Handle public key upload
+        if 'public_key' in request.files:
+            public_key_file = request.files['public_key']
+            if public_key_file.filename:
+                ssh_public_key = read_ssh_key_upload(public_key_file).strip()
+
+        # Handle private key upload
+        if 'private_key' in request.files:
+            private_key_file = request.files['private_key']
+            if private_key_file.filename:
+                ssh_private_key = read_ssh_key_upload(private_key_file).strip()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
 
     # Handle pasted public key
     if not ssh_public_key and request.form.get('ssh_public_key'):
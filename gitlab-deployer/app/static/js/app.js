@@ -763,21 +763,12 @@ function executeDeployment(deploymentId) {
     })
     .then(response => response.json())
     .then(data => {
-        hideSpinner();
-        if (data.success) {
-            showStatus('success', data.message);
-            if (data.output) {
-                showLogs(data.output);
-            }
-            if (data.runner_urls) {
-                showRunnerStatus(data.runner_urls);
-            }
-        } else {
-            showStatus('error', data.error || 'Deployment failed');
-            if (data.output) {
-                showLogs(data.output);
-            }
+        if ('started' in data) {
+            // Running in the background - pollDeploymentProgress() picks up the result
+            return;
         }
+        hideSpinner();
+        showDeploymentResult(data);
     })
     .catch(error => {
         hideSpinner();
@@ -788,17 +779,47 @@ function executeDeployment(deploymentId) {
     pollDeploymentProgress(deploymentId);
 }
 
+// Show the outcome of a finished deployment
+function showDeploymentResult(data) {
+    if (data.success) {
+        showStatus('success', data.message);
+        if (data.output) {
+            showLogs(data.output);
+        }
+        if (data.runner_urls) {
+            showRunnerStatus(data.runner_urls);
+        }
+    } else {
+        showStatus('error', data.error || 'Deployment failed');
+        if (data.output) {
+            showLogs(data.output);
+        }
+    }
+}
+
 // Poll deployment progress
 function pollDeploymentProgress(deploymentId) {
+    // Only ask for log bytes we haven't seen yet
+    let logOffset = 0;
     const interval = setInterval(() => {
-        fetch(`/api/status/${deploymentId}`)
+        fetch(`/api/status/${deploymentId}?since=${logOffset}`)
             .then(response => response.json())
             .then(data => {
+                if (data.logs) {
+                    showLogs(data.logs.trimEnd());
+                }
+                if (data.next_offset !== undefined) {
+                    logOffset = data.next_offset;
+                }
                 if (data.progress) {
                     updateProgress(data.current_step, data.progress);
                 }
                 if (data.completed) {
                     clearInterval(interval);
+                    if (data.result) {
+                        hideSpinner();
+                        showDeploymentResult(data.result);
+                    }
                 }
             })
             .catch(() => {